@@ -6,6 +6,9 @@ import random
 import requests
 import base64
 import numpy as np
+from image_engine import get_vignette_mask, sharpen_vignette, compose_collage, layouts_for
+from image_engine import available_formats, encode_image, output_mime, output_ext
+from image_pipeline import StageGraph
 
 # --- إعدادات الصفحة ---
 st.set_page_config(page_title="DriouchCity Editor", layout="centered")
@@ -13,60 +16,42 @@ st.title("🎬 محرر الصور (DriouchCity)")
 
 # --- دوال المعالجة (نفس الدوال السابقة) ---
 
-def resize_and_crop_center(image: Image.Image, target_size: tuple) -> Image.Image:
-    target_width, target_height = target_size
-    width_ratio = target_width / image.width
-    height_ratio = target_height / image.height
-    scale_factor = max(width_ratio, height_ratio)
-    new_width = int(image.width * scale_factor)
-    new_height = int(image.height * scale_factor)
-    img_resized = image.resize((new_width, new_height), Image.LANCZOS)
-    left = (new_width - target_width) / 2
-    top = (new_height - target_height) / 2
-    right = (new_width + target_width) / 2
-    bottom = (new_height + target_height) / 2
-    return img_resized.crop((left, top, right, bottom))
-
-def create_vignette(image, corner_darkness=150):
+def create_vignette(image, corner_darkness=150, sharpness=1.0):
     width, height = image.size
-    x = np.linspace(-1, 1, width)
-    y = np.linspace(-1, 1, height)
-    X, Y = np.meshgrid(x, y)
-    radius = np.sqrt(X**2 + Y**2)
-    radius = radius / np.max(radius)
-    alpha = 1 - radius
-    alpha = np.power(alpha, 2) 
-    vignette_mask = Image.fromarray((alpha * 255).astype('uint8'), mode='L')
-    black_layer = Image.new('RGB', (width, height), 'black')
-    final_composite = Image.composite(image, black_layer, vignette_mask)
-    vignette_layer = Image.new('RGBA', (width, height), (0,0,0, corner_darkness))
-    vignette_layer.putalpha(ImageOps.invert(vignette_mask).point(lambda p: p * (corner_darkness/255)))
-    final_image = Image.alpha_composite(image.convert('RGBA'), vignette_layer)
-    return final_image.convert('RGB')
+    # قناع جاهز من الذاكرة: تعتيم الأطراف بقدر corner_darkness
+    # (نفس نتيجة طبقة RGBA السوداء + alpha_composite في تركيب واحد)
+    vignette_mask = get_vignette_mask(width, height, 2, corner_darkness)
+    # الحدة + الفينييت في مرور واحد
+    return sharpen_vignette(image, sharpness, vignette_mask)
 
 def apply_cinematic_effect(image: Image.Image) -> Image.Image:
-    # قلب الصورة أفقياً أولاً كما طلبت
+    # تأثيرات كل خانة: القلب ثم التباين والألوان (الحدة والفينييت على اللوحة كاملة)
     img_processed = ImageOps.mirror(image)
     
     # التباين والألوان
     enhancer_contrast = ImageEnhance.Contrast(img_processed)
     img_processed = enhancer_contrast.enhance(1.3)
     enhancer_color = ImageEnhance.Color(img_processed)
-    img_processed = enhancer_color.enhance(0.8)
-    enhancer_sharpness = ImageEnhance.Sharpness(img_processed)
-    img_processed = enhancer_sharpness.enhance(1.2)
-    
-    # الفينييت
-    img_processed = create_vignette(img_processed)
-    return img_processed
+    return enhancer_color.enhance(0.8)
+
+# أسماء التخطيطات في الواجهة
+LAYOUT_LABELS = {
+    'single': "صورة كاملة",
+    'side_by_side': "جنباً إلى جنب",
+    'two_plus_one': "كبيرة + اثنتان",
+    'three_columns': "ثلاثة أعمدة",
+    'grid_2x2': "شبكة 2x2",
+    'two_plus_three': "اثنتان + ثلاث",
+    'grid_3x2': "شبكة 3x2",
+}
 
-def upload_to_wordpress(image_bytes, filename, wp_url, wp_user, wp_password):
+def upload_to_wordpress(image_bytes, filename, wp_url, wp_user, wp_password, fmt='jpeg'):
     credentials = f"{wp_user}:{wp_password}"
     token = base64.b64encode(credentials.encode()).decode('utf-8')
     headers = {
         'Authorization': f'Basic {token}',
         'Content-Disposition': f'attachment; filename={filename}',
-        'Content-Type': 'image/png'
+        'Content-Type': output_mime(fmt)
     }
     try:
         response = requests.post(f"{wp_url}/wp-json/wp/v2/media", headers=headers, data=image_bytes)
@@ -77,68 +62,68 @@ def upload_to_wordpress(image_bytes, filename, wp_url, wp_user, wp_password):
 # --- واجهة التطبيق والمنطق ---
 
 st.sidebar.header("1. رفع الصور")
-st.sidebar.info("ارفع صورة واحدة لتملأ الإطار، أو صورتين لدمجهما.")
-uploaded_file1 = st.sidebar.file_uploader("الصورة الأولى (الرئيسية/يمين)", type=['jpg', 'png', 'jpeg'])
-uploaded_file2 = st.sidebar.file_uploader("الصورة الثانية (يسار - اختياري)", type=['jpg', 'png', 'jpeg'])
+st.sidebar.info("ارفع من صورة واحدة إلى 6 صور؛ الأولى تأخذ أعلى اليمين.")
+uploaded_files = (st.sidebar.file_uploader(
+    "الصور (1 إلى 6)", type=['jpg', 'png', 'jpeg'], accept_multiple_files=True
+) or [])[:6]
+layout = None
+if uploaded_files:
+    layout = st.sidebar.selectbox(
+        "التخطيط", layouts_for(len(uploaded_files)), format_func=LAYOUT_LABELS.get
+    )
 
 st.sidebar.header("2. إعدادات ووردبريس")
 wp_url_input = st.sidebar.text_input("رابط الموقع", "")
 wp_user_input = st.sidebar.text_input("اسم المستخدم", "")
 wp_password_input = st.sidebar.text_input("كلمة مرور التطبيق", type="password")
 
-if uploaded_file1:
+st.sidebar.header("3. الإخراج")
+# PNG كان يتجاهل الجودة ويعطي ملفات أكبر بعدة مرات: JPEG/WebP أصغر وأسرع في الرفع
+out_format = st.sidebar.selectbox("صيغة الملف", available_formats())
+out_quality = st.sidebar.slider("الجودة", 50, 100, 90)
+# الخانات الطولية تقطع الوجوه مع القص المركزي
+smart_crop = st.sidebar.checkbox("قص ذكي لكل خانة (يتبع الموضوع)", value=False)
+
+if uploaded_files:
     st.header("النتيجة")
     
     # الأبعاد النهائية الثابتة
     FINAL_W, FINAL_H = 768, 432
-    final_canvas = Image.new('RGB', (FINAL_W, FINAL_H))
+
+    # كل إعادة تشغيل (مثل زر الإرسال) تعيد الناتج المحفوظ ما لم تتغير الصور أو الإعدادات
+    stages = st.session_state.setdefault("collage_stages", StageGraph())
+    file_ids = tuple(getattr(f, "file_id", (f.name, f.size)) for f in uploaded_files)
 
     with st.spinner('جاري المعالجة...'):
-        img1_org = Image.open(uploaded_file1).convert('RGB')
-        
-        if uploaded_file2:
-            # === حالة دمج صورتين ===
-            img2_org = Image.open(uploaded_file2).convert('RGB')
-            
-            # كل صورة تأخذ نصف العرض
-            SPLIT_W = int(FINAL_W / 2) # 384
-            
-            # قص ومعالجة الصورة 1
-            img1_ready = resize_and_crop_center(img1_org, (SPLIT_W, FINAL_H))
-            img1_ready = apply_cinematic_effect(img1_ready)
-            
-            # قص ومعالجة الصورة 2
-            img2_ready = resize_and_crop_center(img2_org, (SPLIT_W, FINAL_H))
-            img2_ready = apply_cinematic_effect(img2_ready)
-            
-            # اللصق (الصورة 2 يسار، الصورة 1 يمين)
-            final_canvas.paste(img2_ready, (0, 0))
-            final_canvas.paste(img1_ready, (SPLIT_W, 0))
-            
-        else:
-            # === حالة صورة واحدة ===
-            # الصورة تملأ العرض والارتفاع كاملاً
-            img1_ready = resize_and_crop_center(img1_org, (FINAL_W, FINAL_H))
-            img1_ready = apply_cinematic_effect(img1_ready)
-            final_canvas.paste(img1_ready, (0, 0))
+        def render_collage():
+            # كل صورة تُفك وتُقص لخانتها وتُعالج بالتوازي، ثم تُكتب في لوحة واحدة
+            sources = [io.BytesIO(f.getvalue()) for f in uploaded_files]
+            canvas = compose_collage(sources, layout, (FINAL_W, FINAL_H), apply_cinematic_effect, smart_crop)
+            # الحدة + الفينييت مرة واحدة على اللوحة النهائية
+            return create_vignette(canvas, sharpness=1.2)
+
+        final_canvas = stages.stage("collage", render_collage, files=file_ids, layout=layout, smart=smart_crop)
 
         st.image(final_canvas, caption=f"المقاس: {FINAL_W}x{FINAL_H}", use_column_width=True)
 
-        # التحضير للتحميل
+        # الترميز واسم الملف محفوظان أيضاً: نفس الملف للتحميل وللإرسال
+        byte_im = stages.stage(
+            "encode", lambda im: encode_image(im, out_format, out_quality), "collage",
+            fmt=out_format, quality=out_quality
+        )
         today_str = datetime.date.today().strftime("%Y%m%d")
-        random_num = random.randint(10000, 99999)
-        filename_str = f"driouchcity-{today_str}-{random_num}.png"
-        
-        buf = io.BytesIO()
-        final_canvas.save(buf, format="PNG", quality=95)
-        byte_im = buf.getvalue()
+        filename_str = stages.stage(
+            "filename",
+            lambda _: f"driouchcity-{today_str}-{random.randint(10000, 99999)}.{output_ext(out_format)}",
+            "encode"
+        )
 
         c1, c2 = st.columns(2)
-        c1.download_button("📥 تحميل محلي", data=byte_im, file_name=filename_str, mime="image/png")
+        c1.download_button("📥 تحميل محلي", data=byte_im, file_name=filename_str, mime=output_mime(out_format))
         
         if c2.button("🚀 إرسال لووردبريس"):
             if wp_url_input and wp_user_input and wp_password_input:
-                res = upload_to_wordpress(byte_im, filename_str, wp_url_input, wp_user_input, wp_password_input)
+                res = upload_to_wordpress(byte_im, filename_str, wp_url_input, wp_user_input, wp_password_input, out_format)
                 if isinstance(res, requests.models.Response) and res.status_code == 201:
                     st.success(f"تم الرفع: {filename_str}")
                 else:
@@ -6,6 +6,7 @@ import google.generativeai as genai
 from PIL import Image, ImageEnhance, ImageOps
 import io
 import numpy as np
+from image_engine import get_vignette_mask, sharpen_vignette, image_stats, auto_factors, select_frame
 
 # --- إعدادات الصفحة ---
 st.set_page_config(page_title="المحرر الذكي الشامل", layout="wide", page_icon="🚀")
@@ -23,47 +24,47 @@ with st.sidebar:
     # احصل على المفتاح من: https://aistudio.google.com/app/apikey
     api_key = st.text_input("مفتاح Gemini API", type="password")
 
+    st.divider()
+    st.header("3. الصورة")
+    auto_enhance = st.checkbox("تحسين تلقائي حسب الصورة", value=False)
+
 # --- دوال معالجة الصور (الفلاتر) ---
-def create_vignette(image, corner_darkness=180):
+def create_vignette(image, corner_darkness=180, sharpness=1.0):
     # إضافة هالة سوداء سينمائية للأطراف
     if image.mode != 'RGB':
         image = image.convert('RGB')
     width, height = image.size
-    
-    # إنشاء قناع التدرج
-    x = np.linspace(-1, 1, width)
-    y = np.linspace(-1, 1, height)
-    X, Y = np.meshgrid(x, y)
-    radius = np.sqrt(X**2 + Y**2)
-    radius = radius / np.max(radius)
-    alpha = 1 - radius
-    alpha = np.power(alpha, 1.5) # التحكم في نعومة التدرج
-    
-    # تطبيق القناع
-    vignette_mask = Image.fromarray((alpha * 255).astype('uint8'), mode='L')
-    black_layer = Image.new('RGB', (width, height), 'black')
-    return Image.composite(image, black_layer, vignette_mask)
+    # القناع محفوظ في الذاكرة للمقاسات حتى 1 ميغابكسل؛ الصور الأكبر تبني قناعها لكل صورة
+    vignette_mask = get_vignette_mask(width, height, 1.5)
+    # الحدة + التركيب مع الطبقة السوداء في مرور واحد
+    return sharpen_vignette(image, sharpness, vignette_mask)
 
-def process_image_for_news(image_url):
+def process_image_for_news(image_url, auto=False):
     try:
         # 1. تحميل الصورة
         response = requests.get(image_url, stream=True)
-        img = Image.open(response.raw)
+        # صور GIF/WebP المتحركة: إطار واحد فقط بدل الحركة كلها
+        img = select_frame(Image.open(response.raw))
+        
+        # العوامل الثابتة، أو من إحصاءات نسخة 128px من الصورة نفسها
+        saturation, contrast, brightness = 1.4, 1.2, 1.0
+        if auto:
+            saturation, contrast, brightness = auto_factors(image_stats(img), saturation, contrast)
+        if brightness != 1:
+            # Brightness = ضرب كل قناة بالعامل مع القطع: جدول واحد يطابقه بدل المزج مع صورة سوداء
+            lut = [min(255, int(v * brightness)) for v in range(256)]
+            img = img.point(lut * len(img.getbands()))
         
         # 2. تحسين الألوان (Saturation)
         converter = ImageEnhance.Color(img)
-        img = converter.enhance(1.4) # زيادة التشبع 40%
+        img = converter.enhance(saturation) # زيادة التشبع 40% (بدون التلقائي)
         
         # 3. تحسين التباين (Contrast)
         converter = ImageEnhance.Contrast(img)
-        img = converter.enhance(1.2) # زيادة التباين 20%
-        
-        # 4. تحسين الحدة (Sharpness)
-        converter = ImageEnhance.Sharpness(img)
-        img = converter.enhance(1.3)
+        img = converter.enhance(contrast) # زيادة التباين 20% (بدون التلقائي)
         
-        # 5. إضافة الفينييت (تأثير انستغرام/سينمائي)
-        img = create_vignette(img)
+        # 4. تحسين الحدة + الفينييت في مرور واحد
+        img = create_vignette(img, sharpness=1.3)
         
         # تحويل النتيجة لملف جاهز للرفع
         buf = io.BytesIO()
@@ -144,7 +145,7 @@ if st.button("✨ تشغيل المعالج السحري"):
             # 2. معالجة الصورة
             status_box.write("🎨 جاري تحسين الصورة وإضافة التأثيرات...")
             if article.top_image:
-                processed_image = process_image_for_news(article.top_image)
+                processed_image = process_image_for_news(article.top_image, auto_enhance)
                 st.image(processed_image, caption="الصورة بعد المعالجة (ألوان + فينييت)", width=400)
             else:
                 processed_image = None
@@ -6,6 +6,7 @@ import google.generativeai as genai
 from PIL import Image, ImageEnhance
 import io
 import numpy as np
+from image_engine import get_vignette_mask, sharpen_vignette
 
 # --- إعدادات الصفحة ---
 st.set_page_config(page_title="المحرر الذكي (Gemini Pro)", layout="wide", page_icon="🗞️")
@@ -24,20 +25,14 @@ with st.sidebar:
     st.caption("احصل عليه من: aistudio.google.com")
 
 # --- دوال معالجة الصور ---
-def create_vignette(image):
+def create_vignette(image, sharpness=1.0):
     if image.mode != 'RGB':
         image = image.convert('RGB')
     width, height = image.size
-    x = np.linspace(-1, 1, width)
-    y = np.linspace(-1, 1, height)
-    X, Y = np.meshgrid(x, y)
-    radius = np.sqrt(X**2 + Y**2)
-    radius = radius / np.max(radius)
-    alpha = 1 - radius
-    alpha = np.power(alpha, 1.5)
-    vignette_mask = Image.fromarray((alpha * 255).astype('uint8'), mode='L')
-    black_layer = Image.new('RGB', (width, height), 'black')
-    return Image.composite(image, black_layer, vignette_mask)
+    # القناع محفوظ في الذاكرة للمقاسات حتى 1 ميغابكسل؛ الصور الأكبر تبني قناعها لكل صورة
+    vignette_mask = get_vignette_mask(width, height, 1.5)
+    # الحدة + التركيب مع الطبقة السوداء في مرور واحد
+    return sharpen_vignette(image, sharpness, vignette_mask)
 
 def process_image_for_news(image_url):
     try:
@@ -53,10 +48,7 @@ def process_image_for_news(image_url):
         converter = ImageEnhance.Contrast(img)
         img = converter.enhance(1.2) 
         
-        converter = ImageEnhance.Sharpness(img)
-        img = converter.enhance(1.3)
-        
-        img = create_vignette(img)
+        img = create_vignette(img, sharpness=1.3)
         
         buf = io.BytesIO()
         img.save(buf, format='JPEG', quality=95)
@@ -6,6 +6,7 @@ import google.generativeai as genai
 from PIL import Image, ImageEnhance
 import io
 import numpy as np
+from image_engine import get_vignette_mask, sharpen_vignette
 
 # --- إعدادات الصفحة ---
 st.set_page_config(page_title="المحرر الذكي (Gemini 2.0)", layout="wide", page_icon="🚀")
@@ -23,26 +24,15 @@ with st.sidebar:
     api_key = st.text_input("مفتاح Gemini API", type="password")
 
 # --- دوال معالجة الصور ---
-def create_vignette(image):
+def create_vignette(image, sharpness=1.0):
     # التأكد من نمط الألوان
     if image.mode != 'RGB':
         image = image.convert('RGB')
-        
     width, height = image.size
-    x = np.linspace(-1, 1, width)
-    y = np.linspace(-1, 1, height)
-    X, Y = np.meshgrid(x, y)
-    
-    radius = np.sqrt(X**2 + Y**2)
-    radius = radius / np.max(radius)
-    
-    alpha = 1 - radius
-    alpha = np.power(alpha, 1.5) # نعومة التدرج
-    
-    vignette_mask = Image.fromarray((alpha * 255).astype('uint8'), mode='L')
-    black_layer = Image.new('RGB', (width, height), 'black')
-    
-    return Image.composite(image, black_layer, vignette_mask)
+    # القناع محفوظ في الذاكرة للمقاسات حتى 1 ميغابكسل؛ الصور الأكبر تبني قناعها لكل صورة
+    vignette_mask = get_vignette_mask(width, height, 1.5)
+    # الحدة + التركيب مع الطبقة السوداء في مرور واحد
+    return sharpen_vignette(image, sharpness, vignette_mask)
 
 def process_image_for_news(image_url):
     try:
@@ -61,12 +51,8 @@ def process_image_for_news(image_url):
         converter = ImageEnhance.Contrast(img)
         img = converter.enhance(1.2) 
         
-        # 3. زيادة الحدة (Sharpness)
-        converter = ImageEnhance.Sharpness(img)
-        img = converter.enhance(1.3)
-        
-        # 4. إضافة الهالة السوداء
-        img = create_vignette(img)
+        # 3. زيادة الحدة + الفينييت في مرور واحد
+        img = create_vignette(img, sharpness=1.3)
         
         # الحفظ في الذاكرة
         buf = io.BytesIO()
@@ -6,6 +6,7 @@ import google.generativeai as genai
 from PIL import Image, ImageEnhance, ImageOps, ImageBlend
 import io
 import re
+from image_engine import open_for_target, enhance_colors
 
 # --- 1. إعدادات الصفحة ---
 st.set_page_config(page_title="المحرر الاحترافي 5.0", layout="wide", page_icon="📰")
@@ -24,6 +25,8 @@ with st.sidebar:
     remove_logo = st.checkbox("قص اللوغو السفلي", value=True)
     # خيار قوة اللون الأحمر (الافتراضي خفيف جداً 0.15)
     red_intensity = st.slider("كثافة المسحة الحمراء", 0.0, 0.5, 0.10, 0.05)
+    # الصور الداكنة أو الباهتة: العوامل من إحصاءات الصورة بدل 1.5 / 1.1 الثابتة
+    auto_enhance = st.checkbox("تحسين تلقائي حسب الصورة", value=False)
 
 # --- 3. الدوال البرمجية المتقدمة ---
 
@@ -59,17 +62,14 @@ def resize_to_exact_dimensions(image, target_w=768, target_h=432):
         
     return img_final
 
-def process_image_pro(image_input, crop_logo, red_factor):
+def process_image_pro(image_input, crop_logo, red_factor, auto=False):
     try:
         # تحميل الصورة
         if isinstance(image_input, str): 
             response = requests.get(image_input, stream=True)
-            img = Image.open(response.raw)
-        else: 
-            img = Image.open(image_input)
-        
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+            image_input = response.raw
+        # فك JPEG بأصغر مقياس يكفي للأبعاد النهائية (768x432)
+        img = open_for_target(image_input, (768, 432), 0.12 if crop_logo else 0.0)
 
         # 1. قص اللوغو (أولاً وقبل أي شيء)
         if crop_logo:
@@ -83,17 +83,9 @@ def process_image_pro(image_input, crop_logo, red_factor):
         # 3. ضبط الأبعاد الصارم (768x432)
         img = resize_to_exact_dimensions(img, 768, 432)
 
-        # 4. المعالجة اللونية
-        # زيادة التشبع اللوني (Saturation) بشكل ملحوظ
-        img = ImageEnhance.Color(img).enhance(1.5) 
-        # زيادة التباين قليلاً
-        img = ImageEnhance.Contrast(img).enhance(1.1)
-        
-        # 5. إضافة المسحة الحمراء الخفيفة جداً (Red Tint)
-        # ننشئ طبقة حمراء ونخلطها بنسبة ضئيلة جداً (Overlay)
-        red_layer = Image.new('RGB', img.size, (150, 0, 0)) # أحمر قاني
+        # 4-5. التشبع + التباين في مصفوفة ألوان واحدة، ثم المسحة الحمراء (150, 0, 0) بجدول بعدها
         # red_factor يتحكم في الشفافية (0.10 يعني 10% فقط أحمر)
-        img = Image.blend(img, red_layer, alpha=red_factor)
+        img = enhance_colors(img, 1.5, 1.1, red_factor, (150, 0, 0), auto=auto)
 
         buf = io.BytesIO()
         img.save(buf, format='JPEG', quality=95)
@@ -219,7 +211,7 @@ if start:
                 status.write("🎨 هندسة الصورة (768x432)...")
                 final_img = None
                 if target_image:
-                    final_img = process_image_pro(target_image, remove_logo, red_intensity)
+                    final_img = process_image_pro(target_image, remove_logo, red_intensity, auto_enhance)
                     if final_img:
                         st.image(final_img, caption="768x432 Pixel Perfect", width=400)
                 
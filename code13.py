@@ -11,6 +11,14 @@ try:
     import io
     import re
     import numpy as np
+    from image_engine import render_cover, decode_cached, enhance_colors, read_source
+    from image_engine import make_preview_proxy, PREVIEW_SIZE, apply_tint, encode_image
+    from image_engine import available_formats, output_mime, output_ext
+    from image_engine import RENDITIONS, master_size, render_renditions, encode_renditions
+    from image_engine import is_large_source, render_cover_bounded, sweep_variants, AUTO_CROP
+    from image_engine import watermark_templates, WATERMARK_DIR, crop_params
+    from image_pipeline import StageGraph
+    from image_cache import cache_key, cache_get, cache_put
 except ImportError as e:
     st.error(f"❌ مكتبة ناقصة: {e}")
     st.stop()
@@ -36,12 +44,38 @@ with st.sidebar:
     st.divider()
     st.header("3. هندسة الصورة")
     crop_logo = st.checkbox("قص الشريط السفلي (اللوغو)", value=True)
-    logo_ratio = st.slider("نسبة القص", 0.0, 0.25, 0.12, step=0.01)
+    auto_logo = st.checkbox("كشف الشريط والعلامات المائية تلقائياً", value=False)
+    logo_ratio = st.slider("نسبة القص", 0.0, 0.25, 0.12, step=0.01, disabled=auto_logo)
+    if auto_logo:
+        # الشريط (أسفل/أعلى) وعلامات الزوايا تُكشف من كل صورة على نسخة مصغرة، والشريحة لا تُستعمل
+        logo_ratio = AUTO_CROP
+        if not watermark_templates():
+            st.caption(f"لا قوالب علامات مائية في {WATERMARK_DIR}: يُكشف الشريط فقط")
+    smart_crop = st.checkbox("قص ذكي: النافذة حيث الموضوع بدل الوسط", value=False)
     apply_mirror = st.checkbox("قلب الصورة (Mirror)", value=True)
-    red_factor = st.slider("لمسة اللون الأحمر", 0.0, 0.3, 0.08, step=0.01)
+    red_factor = st.slider("لمسة اللون الأحمر", 0.0, 0.3, 0.08, step=0.01, key="red_factor")
+    sat_factor = st.slider("تشبع الألوان", 1.0, 2.2, 1.6, step=0.05, key="sat_factor")
+    # الإضاءة والتباين والتشبع من إحصاءات كل صورة حول القيم أعلاه
+    auto_enhance = st.checkbox("تحسين تلقائي حسب الصورة", value=False)
+
+    st.divider()
+    st.header("4. الإخراج")
+    out_format = st.selectbox("صيغة الملف", available_formats())
+    out_quality = st.slider("الجودة", 50, 100, 95)
+    out_chroma = st.selectbox("دقة الألوان (Chroma)", ["4:2:0", "4:4:4"])
+    strip_meta = st.checkbox("حذف بيانات EXIF/ICC", value=True)
+    out_max_kb = st.number_input("الحجم الأقصى KB (0 = بدون)", 0, 2000, 0, step=10)
+    out_min_sim = st.slider("أدنى تشابه SSIM (0 = بدون)", 0.0, 0.99, 0.0, 0.01)
+    enc = dict(fmt=out_format, quality=out_quality, subsampling=out_chroma, strip_metadata=strip_meta,
+               max_bytes=out_max_kb * 1024 or None, min_similarity=out_min_sim or None)
+    extra_renditions = st.checkbox("نسخ إضافية: بطاقة اجتماعية 1200x630 + مصغرة 300px", value=False)
 
 # --- 3. الدوال ---
 
+# ثوابت السلسلة: نفس القيم تمر إلى المحرك وإلى مفاتيح ذاكرة القرص
+LOOK = dict(contrast=1.15, sharpness=1.3)
+TINT_COLOR = (180, 20, 20)
+
 def clean_final_text(text):
     if not text: return ""
     text = text.replace("###SPLIT###", "")
@@ -50,72 +84,129 @@ def clean_final_text(text):
     text = text.replace("العنوان:", "").replace("المتن:", "")
     return text.strip()
 
-def resize_fixed_768(image):
-    target_w, target_h = 768, 432
-    current_w, current_h = image.size
-    target_ratio = target_w / target_h
-    current_ratio = current_w / current_h
+def resize_fixed_768(image, crop_amount=0.0, mirror=False, smart=False):
+    # قص اللوغو + القص المركزي (أو الذكي) + الأبعاد في إعادة تحجيم واحدة، والقلب على الناتج الصغير
+    return render_cover(image, (768, 432), crop_amount, mirror, smart)
+
+def cover_stage(stages, data, crop, smart=False):
+    """مرحلتا فك الترميز والقص (768x432) المشتركتان بين المعالجة والبدائل"""
+    if is_large_source(io.BytesIO(data)):
+        # صورة ضخمة: قص + أبعاد بشرائح تحت سقف الذاكرة، دون الاحتفاظ بالأصل مفكوكاً
+        img = stages.stage(
+            "cover", lambda d: render_cover_bounded(io.BytesIO(d), (768, 432), crop, smart=smart),
+            "fetch", **crop_params(crop), smart=smart
+        )
+        st.caption(f"تقدير ذروة ذاكرة البكسلات: {img.info['peak_estimate'] / 2**20:.0f} MB")
+        return img
+    # فك الترميز بمقياس يكفي لأكبر نسبة قص (0.25) حتى لا يتغير مع الشريحة
+    img = stages.stage("decode", lambda d: decode_cached(d, (768, 432), 0.25), "fetch")
     
-    if current_ratio > target_ratio:
-        new_h = target_h
-        # إصلاح الخطأ السابق: حساب القيمة ثم تحويلها لـ int
-        calc_w = new_h * current_ratio
-        new_w = int(calc_w)
+    # 1-2. قص اللوغو + الأبعاد (768x432)
+    return stages.stage("cover", lambda im: resize_fixed_768(im, crop, smart=smart), "decode", **crop_params(crop), smart=smart)
+
+def process_img_pro(source, is_url, do_crop, crop_amount, do_mirror, red_val, enc=None, sat_val=1.6, smart=False, auto=False):
+    try:
+        enc = enc or dict(fmt='jpeg', quality=95)
+        # كل مرحلة محفوظة في الجلسة حسب مدخلاتها:
+        # تغيير الأحمر يعيد الخلط والترميز فقط، وتغيير القلب لا يعيد فك الترميز ولا القص
+        stages = st.session_state.setdefault("img_stages", StageGraph())
+        crop = crop_amount if do_crop else 0.0
+        sid = source if is_url else getattr(source, "file_id", (source.name, source.size))
         
-        img = image.resize((new_w, new_h), Image.LANCZOS)
-        left = (new_w - target_w) // 2
-        img = img.crop((left, 0, left + target_w, target_h))
-    else:
-        new_w = target_w
-        # إصلاح الخطأ السابق هنا أيضاً
-        calc_h = new_w / current_ratio
-        new_h = int(calc_h)
+        data = stages.stage("fetch", lambda: read_source(source, is_url), source=sid)
+        
+        # 0. ذاكرة النتائج: نفس الصورة + نفس الإعدادات = نفس الملف النهائي
+        look = dict(LOOK, saturation=sat_val, auto=auto)
+        key = cache_key(
+            data, **crop_params(crop), smart=smart, mirror=do_mirror, red=red_val, tint=TINT_COLOR, **look, **enc
+        )
+        cached = cache_get(key)
+        if cached:
+            return cached
+        
+        img = cover_stage(stages, data, crop, smart)
         
-        img = image.resize((new_w, new_h), Image.LANCZOS)
-        top = (new_h - target_h) // 2
-        img = img.crop((0, top, target_w, top + target_h))
-    return img
+        # 3. الألوان + الحدة (بدون الأحمر)
+        img = stages.stage(
+            "enhance", lambda im: enhance_colors(im, **look), "cover", **look
+        )
+        
+        # 4. القلب (الألوان والحدة متماثلة أفقياً فالترتيب لا يغير النتيجة)
+        img = stages.stage("mirror", lambda im: ImageOps.mirror(im) if do_mirror else im, "enhance", mirror=do_mirror)
+        
+        # 5. الطبقة الحمراء ثم الترميز
+        img = stages.stage("tint", lambda im: apply_tint(im, red_val, TINT_COLOR), "mirror", red=red_val)
+        out = stages.stage("encode", lambda im: encode_image(im, **enc), "tint", **enc)
+        cache_put(key, out)
+        return out
+    except Exception as e:
+        return None
 
-def process_img_pro(source, is_url, do_crop, crop_amount, do_mirror, red_val):
+def process_img_renditions(
+    source, is_url, do_crop, crop_amount, do_mirror, red_val, enc=None, sat_val=1.6, sizes=RENDITIONS, smart=False, auto=False
+):
+    """نفس معالجة process_img_pro مرة واحدة بأكبر مقاس، ثم كل النسخ (بارزة، اجتماعية، مصغرة) منها"""
     try:
-        if is_url:
-            resp = requests.get(source, stream=True, timeout=10)
-            img = Image.open(resp.raw)
-        else:
-            img = Image.open(source)
-            
-        if img.mode != 'RGB': img = img.convert('RGB')
+        enc = enc or dict(fmt='jpeg', quality=95)
+        stages = st.session_state.setdefault("img_stages", StageGraph())
+        crop = crop_amount if do_crop else 0.0
+        sid = source if is_url else getattr(source, "file_id", (source.name, source.size))
         
-        # 1. قص اللوغو
-        if do_crop:
-            w, h = img.size
-            cut_h = h * (1 - crop_amount)
-            new_h = int(cut_h)
-            img = img.crop((0, 0, w, new_h))
-            
-        # 2. القلب
-        if do_mirror:
-            img = ImageOps.mirror(img)
+        data = stages.stage("fetch", lambda: read_source(source, is_url), source=sid)
         
-        # 3. الأبعاد (768x432)
-        img = resize_fixed_768(img)
+        # ذاكرة النتائج: مفتاح لكل نسخة
+        look = dict(LOOK, saturation=sat_val, auto=auto)
+        keys = {
+            name: cache_key(
+                data, rendition=size, **crop_params(crop), smart=smart, mirror=do_mirror, red=red_val, tint=TINT_COLOR,
+                **look, **enc
+            )
+            for name, size in sizes.items()
+        }
+        cached = {name: cache_get(k) for name, k in keys.items()}
+        if all(cached.values()):
+            return cached
         
-        # 4. الألوان
-        img = ImageEnhance.Color(img).enhance(1.6)
-        img = ImageEnhance.Contrast(img).enhance(1.15)
-        img = ImageEnhance.Sharpness(img).enhance(1.3)
+        # فك الترميز والمعالجة مرة واحدة بالمقاس الذي يكفي لكل النسخ (1200x675)
+        big = master_size(sizes.values())
+        img = stages.stage("r_decode", lambda d: decode_cached(d, big, 0.25), "fetch", size=big)
+        img = stages.stage("r_cover", lambda im: render_cover(im, big, crop, smart=smart), "r_decode", **crop_params(crop), smart=smart)
+        img = stages.stage(
+            "r_enhance", lambda im: enhance_colors(im, **look), "r_cover", **look
+        )
+        img = stages.stage("r_mirror", lambda im: ImageOps.mirror(im) if do_mirror else im, "r_enhance", mirror=do_mirror)
+        img = stages.stage("r_tint", lambda im: apply_tint(im, red_val, TINT_COLOR), "r_mirror", red=red_val)
         
-        # 5. الطبقة الحمراء
-        if red_val > 0:
-            overlay = Image.new('RGB', img.size, (180, 20, 20))
-            img = Image.blend(img, overlay, alpha=red_val)
-        
-        buf = io.BytesIO()
-        img.save(buf, format='JPEG', quality=95)
-        return buf.getvalue()
+        # القص والتصغير لكل نسخة ثم الترميز بالتوازي
+        out = stages.stage(
+            "r_encode", lambda im: encode_renditions(render_renditions(im, sizes), **enc),
+            "r_tint", sizes=tuple(sorted(sizes.items())), **enc
+        )
+        for name, k in keys.items():
+            cache_put(k, out[name])
+        return dict(out)
+    except Exception as e:
+        return None
+
+def variants_img_pro(source, is_url, do_crop, crop_amount, do_mirror, combos, smart=False, auto=False):
+    """معاينات صغيرة لعدة توليفات (الأحمر، التشبع) من نفس صورة 768x432 في مرور NumPy واحد"""
+    try:
+        stages = st.session_state.setdefault("img_stages", StageGraph())
+        crop = crop_amount if do_crop else 0.0
+        sid = source if is_url else getattr(source, "file_id", (source.name, source.size))
+        data = stages.stage("fetch", lambda: read_source(source, is_url), source=sid)
+        img = cover_stage(stages, data, crop, smart)
+        if do_mirror:
+            img = ImageOps.mirror(img)
+        return sweep_variants(img, combos, tint_color=TINT_COLOR, auto=auto, **LOOK)
     except Exception as e:
         return None
 
+def pick_variant(red_val, sat_val):
+    # يضبط الشرائح الجانبية على البديل المختار؛ الترميز بالجودة الكاملة يتم عند الرفع
+    st.session_state["red_factor"] = red_val
+    st.session_state["sat_factor"] = sat_val
+
 def ai_rewrite_pro(txt, key, lang):
     try:
         genai.configure(api_key=key)
@@ -148,7 +239,7 @@ def ai_rewrite_pro(txt, key, lang):
     except Exception as e:
         return f"Error: {e}"
 
-def wp_upload_clean(img_bytes, title, content, url, user, pwd):
+def wp_upload_clean(img_bytes, title, content, url, user, pwd, fmt='jpeg'):
     creds = f"{user}:{pwd}"
     token = base64.b64encode(creds.encode()).decode('utf-8')
     head = {'Authorization': f'Basic {token}'}
@@ -157,8 +248,8 @@ def wp_upload_clean(img_bytes, title, content, url, user, pwd):
     if img_bytes:
         h_img = head.copy()
         h_img.update({
-            'Content-Disposition': 'attachment; filename=news.jpg', 
-            'Content-Type': 'image/jpeg'
+            'Content-Disposition': f'attachment; filename=news.{output_ext(fmt)}', 
+            'Content-Type': output_mime(fmt)
         })
         try:
             r = requests.post(f"{url}/wp-json/wp/v2/media", headers=h_img, data=img_bytes)
@@ -177,20 +268,47 @@ def wp_upload_clean(img_bytes, title, content, url, user, pwd):
     }
     return requests.post(f"{url}/wp-json/wp/v2/posts", headers=h_post, json=data)
 
-def wp_upload_image_only(img_bytes, url, user, pwd):
+def wp_upload_image_only(img_bytes, url, user, pwd, fmt='jpeg', name="processed-img"):
     creds = f"{user}:{pwd}"
     token = base64.b64encode(creds.encode()).decode('utf-8')
     head = {'Authorization': f'Basic {token}'}
     
     h_img = head.copy()
-    fname = f"processed-img-{int(time.time())}.jpg"
+    fname = f"{name}-{int(time.time())}.{output_ext(fmt)}"
     h_img.update({
         'Content-Disposition': f'attachment; filename={fname}', 
-        'Content-Type': 'image/jpeg'
+        'Content-Type': output_mime(fmt)
     })
     
     return requests.post(f"{url}/wp-json/wp/v2/media", headers=h_img, data=img_bytes)
 
+def upload_renditions(renditions, url, user, pwd, fmt='jpeg'):
+    """رفع النسخ الإضافية لمكتبة الوسائط، ويعيد رابط كل نسخة"""
+    links = {}
+    for name, img_bytes in renditions.items():
+        res = wp_upload_image_only(img_bytes, url, user, pwd, fmt, f"processed-{name}")
+        if res.status_code == 201:
+            links[name] = res.json()['source_url']
+    return links
+
+def preview_source(source, is_url):
+    """نسخة مصغرة (≈400px) من المصدر، تُفك مرة واحدة وتبقى في الجلسة"""
+    sid = source if is_url else (source.name, source.size)
+    cached = st.session_state.get("preview_proxy")
+    if cached and cached[0] == sid:
+        return cached[1]
+    try:
+        proxy = make_preview_proxy(read_source(source, is_url))
+    except Exception:
+        return None
+    st.session_state["preview_proxy"] = (sid, proxy)
+    return proxy
+
+def preview_img_pro(proxy, do_crop, crop_amount, do_mirror, red_val, sat_val=1.6, smart=False, auto=False):
+    # نفس خطوات process_img_pro لكن على النسخة المصغرة (بضعة ميلي ثوان)
+    img = render_cover(proxy, PREVIEW_SIZE, crop_amount if do_crop else 0.0, do_mirror, smart)
+    return enhance_colors(img, sat_val, tint_alpha=red_val, tint_color=TINT_COLOR, auto=auto, **LOOK)
+
 # --- 4. الواجهة والتشغيل ---
 st.title("✒️ المحرر (النسخة النهائية 11.0)")
 
@@ -220,6 +338,30 @@ with tab3:
         img_input_only = st.file_uploader("اختر الصورة", key="img_only_file")
     else:
         img_input_only = st.text_input("رابط الصورة:", key="img_only_url")
+    # معاينة حية: تتحدث مع الشرائح الجانبية، والمعالجة الكاملة فقط عند الرفع
+    if img_input_only:
+        proxy = preview_source(img_input_only, isinstance(img_input_only, str))
+        if proxy is not None:
+            st.image(
+                preview_img_pro(proxy, crop_logo, logo_ratio, apply_mirror, red_factor, sat_factor, smart_crop, auto_enhance),
+                caption="معاينة سريعة", width=400
+            )
+    # البدائل: عدة قيم للأحمر والتشبع دفعة واحدة، والاختيار يضبط الشرائح الجانبية
+    if img_input_only and st.checkbox("🎛️ عرض البدائل", key="show_variants"):
+        combos = [
+            (round(min(max(red_factor + dr, 0.0), 0.3), 2), round(min(max(sat_factor + ds, 1.0), 2.2), 2))
+            for ds in (-0.3, 0.0, 0.3) for dr in (-0.05, 0.0, 0.05)
+        ]
+        grid = variants_img_pro(
+            img_input_only, isinstance(img_input_only, str), crop_logo, logo_ratio, apply_mirror, combos,
+            smart=smart_crop, auto=auto_enhance
+        )
+        if grid:
+            cols = st.columns(3)
+            for i, ((r, sv), thumb) in enumerate(zip(combos, grid)):
+                cols[i % 3].image(thumb, caption=f"أحمر {r:.2f} · تشبع {sv:.2f}")
+                cols[i % 3].button("اختيار", key=f"pick_variant_{i}", on_click=pick_variant, args=(r, sv))
+
     if st.button("🎨 رفع الصورة فقط"): mode = "image_only"
 
 # --- التنفيذ ---
@@ -238,19 +380,32 @@ if mode:
                 status.info("جاري المعالجة... ⏳")
                 is_url_mode = True if isinstance(img_input_only, str) else False
                 
-                final_img = process_img_pro(
-                    img_input_only, is_url_mode, crop_logo, logo_ratio, apply_mirror, red_factor
-                )
+                extras = {}
+                if extra_renditions:
+                    extras = process_img_renditions(
+                        img_input_only, is_url_mode, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor,
+                        smart=smart_crop, auto=auto_enhance
+                    ) or {}
+                    final_img = extras.pop("featured", None)
+                else:
+                    final_img = process_img_pro(
+                        img_input_only, is_url_mode, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor,
+                        smart=smart_crop, auto=auto_enhance
+                    )
                 
                 if final_img:
                     st.image(final_img, caption="الصورة النهائية", width=400)
+                    if enc["max_bytes"] and len(final_img) > enc["max_bytes"]:
+                        st.warning(f"⚠️ حتى أقل جودة لم تنزل تحت {out_max_kb} KB: الملف {len(final_img) >> 10} KB")
                     status.info("جاري الرفع...")
-                    res = wp_upload_image_only(final_img, wp_url, wp_user, wp_password)
+                    res = wp_upload_image_only(final_img, wp_url, wp_user, wp_password, out_format)
                     if res.status_code == 201:
                         img_link = res.json()['source_url']
                         st.balloons()
                         st.success("✅ تم الرفع!")
                         st.text_input("رابط الصورة:", img_link)
+                        for name, link in upload_renditions(extras, wp_url, wp_user, wp_password, out_format).items():
+                            st.text_input(f"رابط النسخة ({name}):", link)
                     else:
                         st.error(f"فشل الرفع: {res.text}")
 
@@ -276,12 +431,23 @@ if mode:
                 # 1. الصورة
                 status.write("🎨 هندسة الصورة...")
                 final_img = None
+                extras = {}
                 if target_img:
-                    final_img = process_img_pro(
-                        target_img, is_url, crop_logo, logo_ratio, apply_mirror, red_factor
-                    )
+                    if extra_renditions:
+                        extras = process_img_renditions(
+                            target_img, is_url, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor,
+                            smart=smart_crop, auto=auto_enhance
+                        ) or {}
+                        final_img = extras.pop("featured", None)
+                    else:
+                        final_img = process_img_pro(
+                            target_img, is_url, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor,
+                            smart=smart_crop, auto=auto_enhance
+                        )
                     if final_img:
                         st.image(final_img, caption="الصورة البارزة", width=400)
+                        if enc["max_bytes"] and len(final_img) > enc["max_bytes"]:
+                            st.warning(f"⚠️ حتى أقل جودة لم تنزل تحت {out_max_kb} KB: الملف {len(final_img) >> 10} KB")
 
                 # 2. النص
                 status.write(f"✍️ الصياغة ({target_language})...")
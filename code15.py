@@ -11,6 +11,14 @@ try:
     import io
     import re
     import numpy as np
+    from image_engine import render_cover, decode_cached, enhance_colors, read_source
+    from image_engine import make_preview_proxy, PREVIEW_SIZE, apply_tint, encode_image
+    from image_engine import available_formats, output_mime, output_ext
+    from image_engine import RENDITIONS, master_size, render_renditions, encode_renditions
+    from image_engine import is_large_source, render_cover_bounded, sweep_variants, AUTO_CROP
+    from image_engine import watermark_templates, WATERMARK_DIR, crop_params
+    from image_pipeline import StageGraph
+    from image_cache import cache_key, cache_get, cache_put
 except ImportError as e:
     st.error(f"❌ مكتبة ناقصة: {e}")
     st.stop()
@@ -34,12 +42,36 @@ with st.sidebar:
     st.divider()
     st.header("3. الصورة")
     crop_logo = st.checkbox("قص اللوغو", value=True)
-    logo_ratio = st.slider("نسبة القص", 0.0, 0.25, 0.12, step=0.01)
+    auto_logo = st.checkbox("كشف الشريط والعلامة تلقائياً", value=False)
+    logo_ratio = st.slider("نسبة القص", 0.0, 0.25, 0.12, step=0.01, disabled=auto_logo)
+    if auto_logo:
+        logo_ratio = AUTO_CROP
+        if not watermark_templates():
+            st.caption(f"لا قوالب علامات مائية في {WATERMARK_DIR}: يُكشف الشريط فقط")
+    smart_crop = st.checkbox("قص ذكي (يتبع الموضوع)", value=False)
     apply_mirror = st.checkbox("قلب الصورة", value=True)
-    red_factor = st.slider("لمسة الأحمر", 0.0, 0.3, 0.08, step=0.01)
+    red_factor = st.slider("لمسة الأحمر", 0.0, 0.3, 0.08, step=0.01, key="red_factor")
+    sat_factor = st.slider("التشبع", 1.0, 2.2, 1.6, step=0.05, key="sat_factor")
+    auto_enhance = st.checkbox("تحسين تلقائي", value=False)
+
+    st.divider()
+    st.header("4. الإخراج")
+    out_format = st.selectbox("صيغة الملف", available_formats())
+    out_quality = st.slider("الجودة", 50, 100, 95)
+    out_chroma = st.selectbox("دقة الألوان (Chroma)", ["4:2:0", "4:4:4"])
+    strip_meta = st.checkbox("حذف بيانات EXIF/ICC", value=True)
+    out_max_kb = st.number_input("الحجم الأقصى KB (0 = بدون)", 0, 2000, 0, step=10)
+    out_min_sim = st.slider("أدنى تشابه SSIM (0 = بدون)", 0.0, 0.99, 0.0, 0.01)
+    enc = dict(fmt=out_format, quality=out_quality, subsampling=out_chroma, strip_metadata=strip_meta,
+               max_bytes=out_max_kb * 1024 or None, min_similarity=out_min_sim or None)
+    extra_rend = st.checkbox("نسخ إضافية: اجتماعية 1200x630 + مصغرة 300px", value=False)
 
 # --- 3. الدوال ---
 
+# ثوابت السلسلة: نفس القيم للمحرك ولمفاتيح الذاكرة
+LOOK = dict(contrast=1.15, sharpness=1.3)
+TINT_COLOR = (180, 20, 20)
+
 def clean_text(text):
     if not text: return ""
     junk = ["###SPLIT###", "###", "##", "**", "*", "العنوان:", "المتن:"]
@@ -47,62 +79,95 @@ def clean_text(text):
         text = text.replace(j, "")
     return text.strip()
 
-def resize_768(img):
-    tw, th = 768, 432
-    cw, ch = img.size
-    tr, cr = tw / th, cw / ch
-    
-    if cr > tr:
-        nh = th
-        nw = int(nh * cr)
-        img = img.resize((nw, nh), Image.LANCZOS)
-        left = (nw - tw) // 2
-        img = img.crop((left, 0, left + tw, th))
-    else:
-        nw = tw
-        nh = int(nw / cr)
-        img = img.resize((nw, nh), Image.LANCZOS)
-        top = (nh - th) // 2
-        img = img.crop((0, top, tw, top + th))
-    return img
-
-def process_img(src, is_url, crop, c_amt, mirror, red):
+def resize_768(img, c_amt=0.0, mirror=False, smart=False):
+    # قص + أبعاد + قلب في إعادة تحجيم واحدة
+    return render_cover(img, (768, 432), c_amt, mirror, smart)
+
+def cover_stage(g, data, amt, smart=False):
+    # فك الترميز + القص، مشتركة بين المعالجة والبدائل
+    if is_large_source(io.BytesIO(data)):
+        # صورة ضخمة: شرائح تحت سقف الذاكرة
+        img = g.stage(
+            "cover", lambda d: render_cover_bounded(io.BytesIO(d), (768, 432), amt, smart=smart),
+            "fetch", **crop_params(amt), smart=smart
+        )
+        st.caption(f"تقدير ذروة الذاكرة: {img.info['peak_estimate'] / 2**20:.0f} MB")
+        return img
+    img = g.stage("decode", lambda d: decode_cached(d, (768, 432), 0.25), "fetch")
+    return g.stage("cover", lambda im: resize_768(im, amt, smart=smart), "decode", **crop_params(amt), smart=smart)
+
+def process_img(src, is_url, crop, c_amt, mirror, red, enc=None, sat=1.6, smart=False, auto=False):
     try:
-        if is_url:
-            r = requests.get(src, stream=True, timeout=10)
-            img = Image.open(r.raw)
-        else:
-            img = Image.open(src)
-            
-        if img.mode != 'RGB': 
-            img = img.convert('RGB')
-            
-        if crop:
-            w, h = img.size
-            new_h = int(h * (1 - c_amt))
-            img = img.crop((0, 0, w, new_h))
-            
-        if mirror: 
-            img = ImageOps.mirror(img)
-            
-        img = resize_768(img)
+        enc = enc or dict(fmt='jpeg', quality=95)
+        # مراحل محفوظة في الجلسة: كل مرحلة تُعاد فقط إذا تغيرت مدخلاتها
+        g = st.session_state.setdefault("img_stages", StageGraph())
+        amt = c_amt if crop else 0.0
+        sid = src if is_url else getattr(src, "file_id", (src.name, src.size))
         
-        # الألوان السينمائية
-        img = ImageEnhance.Color(img).enhance(1.6)
-        img = ImageEnhance.Contrast(img).enhance(1.15)
-        img = ImageEnhance.Sharpness(img).enhance(1.3)
+        data = g.stage("fetch", lambda: read_source(src, is_url), source=sid)
+        # ذاكرة النتائج على القرص
+        look = dict(LOOK, saturation=sat, auto=auto)
+        key = cache_key(data, **crop_params(amt), smart=smart, mirror=mirror, red=red, tint=TINT_COLOR, **look, **enc)
+        cached = cache_get(key)
+        if cached: return cached
         
-        if red > 0:
-            # هنا قمنا بتكسير السطر لتفادي الخطأ السابق
-            color = (180, 20, 20)
-            ov = Image.new('RGB', img.size, color)
-            img = Image.blend(img, ov, alpha=red)
-            
-        buf = io.BytesIO()
-        img.save(buf, format='JPEG', quality=95)
-        return buf.getvalue()
+        img = cover_stage(g, data, amt, smart)
+        # الألوان السينمائية، ثم القلب، ثم الأحمر
+        img = g.stage("enhance", lambda im: enhance_colors(im, **look), "cover", **look)
+        img = g.stage("mirror", lambda im: ImageOps.mirror(im) if mirror else im, "enhance", mirror=mirror)
+        img = g.stage("tint", lambda im: apply_tint(im, red, TINT_COLOR), "mirror", red=red)
+        out = g.stage("encode", lambda im: encode_image(im, **enc), "tint", **enc)
+        cache_put(key, out)
+        return out
     except: return None
 
+def process_renditions(src, is_url, crop, c_amt, mirror, red, enc=None, sat=1.6, sizes=RENDITIONS, smart=False, auto=False):
+    # معالجة واحدة بأكبر مقاس (1200x675)، ثم كل النسخ تُقص وتُصغر منها وتُرمز بالتوازي
+    try:
+        enc = enc or dict(fmt='jpeg', quality=95)
+        g = st.session_state.setdefault("img_stages", StageGraph())
+        amt = c_amt if crop else 0.0
+        sid = src if is_url else getattr(src, "file_id", (src.name, src.size))
+        
+        data = g.stage("fetch", lambda: read_source(src, is_url), source=sid)
+        look = dict(LOOK, saturation=sat, auto=auto)
+        keys = {
+            n: cache_key(data, rendition=sz, **crop_params(amt), smart=smart, mirror=mirror, red=red, tint=TINT_COLOR, **look, **enc)
+            for n, sz in sizes.items()
+        }
+        cached = {n: cache_get(k) for n, k in keys.items()}
+        if all(cached.values()): return cached
+        
+        big = master_size(sizes.values())
+        img = g.stage("r_decode", lambda d: decode_cached(d, big, 0.25), "fetch", size=big)
+        img = g.stage("r_cover", lambda im: render_cover(im, big, amt, smart=smart), "r_decode", **crop_params(amt), smart=smart)
+        img = g.stage("r_enhance", lambda im: enhance_colors(im, **look), "r_cover", **look)
+        img = g.stage("r_mirror", lambda im: ImageOps.mirror(im) if mirror else im, "r_enhance", mirror=mirror)
+        img = g.stage("r_tint", lambda im: apply_tint(im, red, TINT_COLOR), "r_mirror", red=red)
+        out = g.stage(
+            "r_encode", lambda im: encode_renditions(render_renditions(im, sizes), **enc),
+            "r_tint", sizes=tuple(sorted(sizes.items())), **enc
+        )
+        for n, k in keys.items(): cache_put(k, out[n])
+        return dict(out)
+    except: return None
+
+def variants(src, is_url, crop, c_amt, mirror, combos, smart=False, auto=False):
+    # معاينات لعدة توليفات (الأحمر، التشبع) من نفس صورة 768x432 في مرور NumPy واحد
+    try:
+        g = st.session_state.setdefault("img_stages", StageGraph())
+        sid = src if is_url else getattr(src, "file_id", (src.name, src.size))
+        data = g.stage("fetch", lambda: read_source(src, is_url), source=sid)
+        img = cover_stage(g, data, c_amt if crop else 0.0, smart)
+        if mirror: img = ImageOps.mirror(img)
+        return sweep_variants(img, combos, tint_color=TINT_COLOR, auto=auto, **LOOK)
+    except: return None
+
+def pick_variant(red, sat):
+    # يضبط الشرائح على البديل المختار، والترميز الكامل عند الرفع
+    st.session_state["red_factor"] = red
+    st.session_state["sat_factor"] = sat
+
 def ai_rewrite(txt, key, lang):
     try:
         genai.configure(api_key=key)
@@ -124,7 +189,7 @@ def ai_rewrite(txt, key, lang):
         return mod.generate_content(pmt).text
     except Exception as e: return f"Error: {e}"
 
-def wp_up_clean(ib, tit, con, url, usr, pwd):
+def wp_up_clean(ib, tit, con, url, usr, pwd, fmt='jpeg'):
     cred = f"{usr}:{pwd}"
     tok = base64.b64encode(cred.encode()).decode('utf-8')
     head = {'Authorization': f'Basic {tok}'}
@@ -133,8 +198,8 @@ def wp_up_clean(ib, tit, con, url, usr, pwd):
     if ib:
         h2 = head.copy()
         h2.update({
-            'Content-Disposition': 'attachment; filename=news.jpg', 
-            'Content-Type': 'image/jpeg'
+            'Content-Disposition': f'attachment; filename=news.{output_ext(fmt)}', 
+            'Content-Type': output_mime(fmt)
         })
         try:
             api = f"{url}/wp-json/wp/v2/media"
@@ -152,21 +217,44 @@ def wp_up_clean(ib, tit, con, url, usr, pwd):
     }
     return requests.post(f"{url}/wp-json/wp/v2/posts", headers=h3, json=d)
 
-def wp_up_img(ib, url, usr, pwd):
+def wp_up_img(ib, url, usr, pwd, fmt='jpeg', name="img"):
     cred = f"{usr}:{pwd}"
     tok = base64.b64encode(cred.encode()).decode('utf-8')
     head = {'Authorization': f'Basic {tok}'}
     
     h2 = head.copy()
-    fn = f"img-{int(time.time())}.jpg"
+    fn = f"{name}-{int(time.time())}.{output_ext(fmt)}"
     h2.update({
         'Content-Disposition': f'attachment; filename={fn}', 
-        'Content-Type': 'image/jpeg'
+        'Content-Type': output_mime(fmt)
     })
     
     api = f"{url}/wp-json/wp/v2/media"
     return requests.post(api, headers=h2, data=ib)
 
+def wp_up_extras(extras, url, usr, pwd, fmt='jpeg'):
+    # رفع النسخ الإضافية وإرجاع روابطها
+    links = {}
+    for n, ib in extras.items():
+        r = wp_up_img(ib, url, usr, pwd, fmt, f"img-{n}")
+        if r.status_code == 201: links[n] = r.json()['source_url']
+    return links
+
+def preview_src(src, is_url):
+    # نسخة مصغرة (≈400px) تُفك مرة واحدة وتبقى في الجلسة
+    sid = src if is_url else (src.name, src.size)
+    c = st.session_state.get("preview_proxy")
+    if c and c[0] == sid: return c[1]
+    try: proxy = make_preview_proxy(read_source(src, is_url))
+    except: return None
+    st.session_state["preview_proxy"] = (sid, proxy)
+    return proxy
+
+def preview_img(proxy, crop, c_amt, mirror, red, sat=1.6, smart=False, auto=False):
+    # نفس خطوات process_img على النسخة المصغرة
+    img = render_cover(proxy, PREVIEW_SIZE, c_amt if crop else 0.0, mirror, smart)
+    return enhance_colors(img, sat, tint_alpha=red, tint_color=TINT_COLOR, auto=auto, **LOOK)
+
 # --- 4. الواجهة ---
 st.title("📰 المحرر (النسخة المصفحة 13.0)")
 t1, t2, t3 = st.tabs(["🔗 رابط", "📝 يدوي", "🖼️ صورة"])
@@ -183,6 +271,23 @@ with t3:
     ic = st.radio("المصدر:", ["ملف", "رابط"], horizontal=True)
     if ic == "ملف": i_only = st.file_uploader("الصورة", key="iof")
     else: i_only = st.text_input("الرابط:", key="iou")
+    # معاينة حية مع الشرائح، والمعالجة الكاملة عند الرفع فقط
+    if i_only:
+        px = preview_src(i_only, isinstance(i_only, str))
+        if px is not None:
+            st.image(preview_img(px, crop_logo, logo_ratio, apply_mirror, red_factor, sat_factor, smart_crop, auto_enhance), caption="معاينة", width=400)
+    # البدائل: شبكة 3x3 حول القيم الحالية، والاختيار يضبط الشرائح
+    if i_only and st.checkbox("🎛️ البدائل", key="show_variants"):
+        combos = [
+            (round(min(max(red_factor + dr, 0.0), 0.3), 2), round(min(max(sat_factor + ds, 1.0), 2.2), 2))
+            for ds in (-0.3, 0.0, 0.3) for dr in (-0.05, 0.0, 0.05)
+        ]
+        grid = variants(i_only, isinstance(i_only, str), crop_logo, logo_ratio, apply_mirror, combos, smart_crop, auto_enhance)
+        if grid:
+            cols = st.columns(3)
+            for i, ((r, sv), th) in enumerate(zip(combos, grid)):
+                cols[i % 3].image(th, caption=f"أحمر {r:.2f} · تشبع {sv:.2f}")
+                cols[i % 3].button("اختيار", key=f"pv_{i}", on_click=pick_variant, args=(r, sv))
     if st.button("🎨 رفع صورة فقط"): mode = "img_only"
 
 if mode:
@@ -198,13 +303,21 @@ if mode:
             else:
                 stat.info("جاري المعالجة...")
                 iu = True if isinstance(i_only, str) else False
-                fi = process_img(i_only, iu, crop_logo, logo_ratio, apply_mirror, red_factor)
+                ex = {}
+                if extra_rend:
+                    ex = process_renditions(i_only, iu, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor, smart=smart_crop, auto=auto_enhance) or {}
+                    fi = ex.pop("featured", None)
+                else:
+                    fi = process_img(i_only, iu, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor, smart=smart_crop, auto=auto_enhance)
                 if fi:
                     st.image(fi, caption="النهاية", width=400)
-                    r = wp_up_img(fi, wp_url, wp_user, wp_password)
+                    if enc["max_bytes"] and len(fi) > enc["max_bytes"]: st.warning(f"⚠️ فوق {out_max_kb} KB حتى بأقل جودة: {len(fi) >> 10} KB")
+                    r = wp_up_img(fi, wp_url, wp_user, wp_password, out_format)
                     if r.status_code == 201:
                         st.success("✅ تم الرفع!")
                         st.text_input("الرابط:", r.json()['source_url'])
+                        for n, lk in wp_up_extras(ex, wp_url, wp_user, wp_password, out_format).items():
+                            st.text_input(f"رابط ({n}):", lk)
                     else: st.error(r.text)
         
         # --- معالجة مقال ---
@@ -221,10 +334,15 @@ if mode:
                     tt, ti = t_val, f_val
                 
                 stat.write("🎨 الصورة...")
-                fi = None
+                fi, ex = None, {}
                 if ti:
-                    fi = process_img(ti, iu, crop_logo, logo_ratio, apply_mirror, red_factor)
+                    if extra_rend:
+                        ex = process_renditions(ti, iu, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor, smart=smart_crop, auto=auto_enhance) or {}
+                        fi = ex.pop("featured", None)
+                    else:
+                        fi = process_img(ti, iu, crop_logo, logo_ratio, apply_mirror, red_factor, enc, sat_factor, smart=smart_crop, auto=auto_enhance)
                     if fi: st.image(fi, width=400)
+                    if fi and enc["max_bytes"] and len(fi) > enc["max_bytes"]: st.warning(f"⚠️ فوق {out_max_kb} KB حتى بأقل جودة: {len(fi) >> 10} KB")
                 
                 stat.write(f"✍️ الصياغة ({target_language})...")
                 rai = ai_rewrite(tt, api_key, target_language)
@@ -245,8 +363,10 @@ if mode:
                     st.markdown(bod)
                     
                     stat.write("🚀 الرفع...")
-                    r = wp_up_clean(fi, tit, bod, wp_url, wp_user, wp_password)
+                    r = wp_up_clean(fi, tit, bod, wp_url, wp_user, wp_password, out_format)
                     if r.status_code == 201:
+                        for n, lk in wp_up_extras(ex, wp_url, wp_user, wp_password, out_format).items():
+                            st.text_input(f"رابط ({n}):", lk)
                         st.balloons()
                         st.success(f"تم! [المعاينة]({r.json()['link']})")
                     else: st.error(r.text)
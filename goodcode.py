@@ -6,6 +6,7 @@ import google.generativeai as genai
 from PIL import Image, ImageEnhance, ImageOps
 import io
 import numpy as np
+from image_engine import get_vignette_mask, sharpen_vignette
 
 # --- 1. إعدادات الصفحة ---
 st.set_page_config(page_title="المحرر الذكي 4.0", layout="wide", page_icon="🔥")
@@ -26,28 +27,18 @@ with st.sidebar:
 
 # --- 3. الدوال البرمجية ---
 
-def create_red_vignette(image):
+def create_red_vignette(image, sharpness=1.0):
     """إضافة هالة حمراء داكنة بدلاً من السوداء"""
     if image.mode != 'RGB':
         image = image.convert('RGB')
     width, height = image.size
-    x = np.linspace(-1, 1, width)
-    y = np.linspace(-1, 1, height)
-    X, Y = np.meshgrid(x, y)
-    
-    radius = np.sqrt(X**2 + Y**2)
-    radius = radius / np.max(radius)
-    alpha = 1 - radius
-    alpha = np.power(alpha, 1.2) # تحكم في انتشار اللون
-    
-    mask_arr = (alpha * 255).astype('uint8')
-    vignette_mask = Image.fromarray(mask_arr, mode='L')
+    # القناع محفوظ في الذاكرة للمقاسات الصغيرة فقط (1.2 تحكم في انتشار اللون)
+    vignette_mask = get_vignette_mask(width, height, 1.2)
     
     # اللون الأحمر الداكن (Dark Red) ليعطي طابعاً درامياً وليس فاقعاً
     # يمكنك تغيير الأرقام (R, G, B) لتفتيح أو تغميق الأحمر
-    red_layer = Image.new('RGB', (width, height), (100, 0, 0)) 
-    
-    return Image.composite(image, red_layer, vignette_mask)
+    # الحدة + التركيب مع اللون الأحمر في مرور واحد
+    return sharpen_vignette(image, sharpness, vignette_mask, (100, 0, 0))
 
 def process_image(image_input, should_crop, crop_ratio):
     try:
@@ -73,8 +64,7 @@ def process_image(image_input, should_crop, crop_ratio):
         # 3. التأثيرات (ألوان + حدة + هالة حمراء)
         img = ImageEnhance.Color(img).enhance(1.3)
         img = ImageEnhance.Contrast(img).enhance(1.2)
-        img = ImageEnhance.Sharpness(img).enhance(1.3)
-        img = create_red_vignette(img) # استخدام الهالة الحمراء
+        img = create_red_vignette(img, sharpness=1.3) # الحدة + الهالة الحمراء
         
         buf = io.BytesIO()
         img.save(buf, format='JPEG', quality=95)
@@ -0,0 +1,347 @@
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from image_cache import cache_key, cache_get, cache_put
+from image_engine import (
+    decode_cached, render_cover, enhance_colors, apply_tint, encode_image, read_source, output_ext,
+    is_large_source, render_cover_bounded, enhance_stack, stack_chunk_size, split_stack, AUTO_CROP,
+    watermark_templates, available_formats, WATERMARK_DIR, crop_params,
+)
+
+# --- معالجة دفعات من الصور (مجلد أو قائمة روابط) على مجموعة عمليات دافئة ---
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+
+_PROCESS_POOL = None
+
+# نفس ثوابت سلسلة المحرر (code9): القيم نفسها تمر إلى المحرك وإلى مفتاح الذاكرة، فالمفتاح مشترك مع التطبيق
+LOOK = dict(contrast=1.15, sharpness=1.3)
+TINT_COLOR = (180, 20, 20)
+
+
+def _warm():
+    # تحميل المكتبات والمرمزات مرة واحدة لكل عملية، وأطياف قوالب العلامات المائية لكل صور الدفعة
+    encode_image(Image.new('RGB', (16, 9)))
+    watermark_templates()
+
+
+def get_process_pool(workers=None):
+    """مجموعة عمليات واحدة بعدد الأنوية، تبقى حية بين الدفعات.
+    spawn لا fork: العملية المنسوخة ترث _POOL في المحرك بسجل خيوطه دون الخيوط نفسها،
+    فتنتظر شرائح الحدة فيها إلى الأبد"""
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        # العاملات ترث متتبع موارد العملية الرئيسية. متتبع خاص بعاملة يعدّ المكدس الذي ربطته
+        # "متسرباً" عند خروجها فيحذر ويحذفه من تحت العملية الرئيسية
+        resource_tracker.ensure_running()
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count() or 2, initializer=_warm,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _PROCESS_POOL
+
+
+def _drop_process_pool():
+    # عملية ماتت (نفاد الذاكرة، إشارة) تعطب المجموعة كلها: الدفعة التالية تبدأ بمجموعة جديدة
+    global _PROCESS_POOL
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=False, cancel_futures=True)
+        _PROCESS_POOL = None
+
+
+def process_source(data, crop=0.0, mirror=False, red=0.08, enc=None, color=1.6, smart=False, auto=False):
+    """نفس خطوات process_img_pro بدون جلسة Streamlit، ونفس مفتاح ذاكرة القرص"""
+    enc = enc or dict(fmt='jpeg', quality=95)
+    look = dict(LOOK, saturation=color, auto=auto)
+    key = cache_key(data, **crop_params(crop), smart=smart, mirror=mirror, red=red, tint=TINT_COLOR, **look, **enc)
+    cached = cache_get(key)
+    if cached:
+        return cached
+    if is_large_source(io.BytesIO(data)):
+        img = render_cover_bounded(io.BytesIO(data), (768, 432), crop, smart=smart)
+    else:
+        # نفس مقياس فك الترميز في التطبيق (0.25) حتى تكون النتيجة مطابقة لمفتاحها
+        img = render_cover(decode_cached(data, (768, 432), 0.25), (768, 432), crop, smart=smart)
+    img = enhance_colors(img, **look)
+    if mirror:
+        img = ImageOps.mirror(img)
+    out = encode_image(apply_tint(img, red, TINT_COLOR), **enc)
+    cache_put(key, out)
+    return out
+
+
+def _process_item(item, settings):
+    # يعمل داخل العملية: الجلب + المعالجة، والخطأ يعود كنص بدل إسقاط الدفعة
+    # العنصر: مسار أو رابط، أو (الاسم، البايتات) لملف مرفوع
+    if isinstance(item, tuple):
+        item, data = item
+    else:
+        data = None
+    try:
+        if data is None:
+            data = read_source(item, item.startswith(('http://', 'https://')))
+        return item, process_source(data, **settings), None
+    except Exception as e:
+        return item, None, f"{type(e).__name__}: {e}"
+
+
+class SharedStack:
+    """مكدس (N, H, W, 3) uint8 في ذاكرة مشتركة: العمليات تكتب فيه وتتلقى الوصف فقط"""
+
+    def __init__(self, count, size=(768, 432)):
+        self.shape = (count, size[1], size[0], 3)
+        self.shm = shared_memory.SharedMemory(create=True, size=count * size[0] * size[1] * 3)
+        self.array = np.ndarray(self.shape, np.uint8, self.shm.buf)
+
+    @property
+    def descriptor(self):
+        # (الاسم، الشكل، النوع): بضع عشرات من البايتات بدل ميغابايت من البكسلات
+        return self.shm.name, self.shape, 'uint8'
+
+    def close(self):
+        # أجزاء من المصفوفة قد تبقى حية (مولد متوقف أو traceback)، فيرفض close() تحرير الذاكرة؛
+        # الاسم يُحذف في كل الأحوال والذاكرة تُحرر مع آخر جزء
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        finally:
+            self.shm.unlink()
+
+
+_ATTACHED = {}
+
+
+def _open_segment(name):
+    # المكدس ملك العملية الرئيسية وهي وحدها تحذفه: 3.13+ تربط دون تسجيل في متتبع الموارد.
+    # قبلها يسجل الربط الاسم في متتبع العملية الرئيسية المشترك (get_process_pool)، وهو مجموعة أسماء
+    # فلا أثر للتكرار. unregister هنا كان سيمحو تسجيل العملية الرئيسية نفسها
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _attach(descriptor):
+    # ربط العملية بالمكدس المشترك مرة واحدة لكل اسم؛ القديمة تُغلق حتى لا تبقى محجوزة
+    name, shape, dtype = descriptor
+    shm = _ATTACHED.get(name)
+    if shm is None:
+        while len(_ATTACHED) >= 4:
+            _ATTACHED.pop(next(iter(_ATTACHED))).close()
+        shm = _ATTACHED[name] = _open_segment(name)
+    return np.ndarray(shape, dtype, shm.buf)
+
+
+def _cover_item(item, settings, descriptor, slot):
+    # يعمل داخل العملية: الجلب + فك الترميز + القص فقط، والناتج يُكتب في خانته من المكدس المشترك
+    if isinstance(item, tuple):
+        item, data = item
+    else:
+        data = None
+    try:
+        if data is None:
+            data = read_source(item, item.startswith(('http://', 'https://')))
+        key = _stack_key(data, settings)
+        cached = cache_get(key)
+        if cached:
+            return item, key, None, cached, None
+        crop, smart = settings.get('crop', 0.0), settings.get('smart', False)
+        if is_large_source(io.BytesIO(data)):
+            img = render_cover_bounded(io.BytesIO(data), (768, 432), crop, smart=smart)
+        else:
+            img = render_cover(decode_cached(data, (768, 432), 0.25), (768, 432), crop, smart=smart)
+        _attach(descriptor)[slot] = np.asarray(img.convert('RGB'))
+        return item, key, slot, None, None
+    except Exception as e:
+        return item, None, None, None, f"{type(e).__name__}: {e}"
+
+
+def _stack_key(data, settings):
+    # نتيجة المكدس تختلف ببضع درجات عن سلسلة PIL: مفتاح مستقل
+    enc = settings.get('enc') or dict(fmt='jpeg', quality=95)
+    return cache_key(
+        data, **crop_params(settings.get('crop', 0.0)), smart=settings.get('smart', False),
+        mirror=settings.get('mirror', False), red=settings.get('red', 0.08), tint=TINT_COLOR,
+        saturation=settings.get('color', 1.6), stacked=True, **LOOK, **enc
+    )
+
+
+def _finish_stack(frames, pending, settings):
+    # الخانات الناجحة تُجمع في أول المكدس، ثم الألوان + الحدة + الأحمر في مكانها (بدون نسخ)
+    for i, (_, _, slot) in enumerate(pending):
+        if slot != i:
+            frames[i] = frames[slot]
+    stack = frames[:len(pending)]
+    split_stack(
+        stack, enhance_stack, settings.get('color', 1.6), tint_alpha=settings.get('red', 0.08),
+        tint_color=TINT_COLOR, **LOOK
+    )
+    if settings.get('mirror'):
+        stack = stack[:, :, ::-1]
+    enc = settings.get('enc') or dict(fmt='jpeg', quality=95)
+    encoded = split_stack(stack, lambda part: [encode_image(Image.fromarray(v), **enc) for v in part])
+    for (item, key, _), out in zip(pending, encoded):
+        cache_put(key, out)
+        yield item, out, None
+
+
+def run_batch_stacked(items, workers=None, mem_limit=None, **settings):
+    """مثل run_batch لكن العمليات تفك وتقص فقط داخل مكدس مشترك، والألوان تُحسب على المكدس كله.
+    مكدسان بالتناوب: العمليات تملأ أحدهما بينما يُعالج الآخر. لا تمر أي بكسلات عبر pickle"""
+    pool = get_process_pool(workers)
+    chunk = stack_chunk_size((768, 432), mem_limit)
+    waves = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+    slabs = [SharedStack(min(chunk, len(items)) or 1) for _ in range(min(2, len(waves)))]
+
+    def submit(wave, slab):
+        return [pool.submit(_cover_item, item, settings, slab.descriptor, slot) for slot, item in enumerate(wave)]
+
+    try:
+        inflight = deque((slab, submit(wave, slab)) for slab, wave in zip(slabs, waves))
+        next_wave = len(inflight)
+        while inflight:
+            slab, futures = inflight.popleft()
+            pending = []
+            for future in as_completed(futures):
+                item, key, slot, cached, err = future.result()
+                if err or cached:
+                    yield item, cached, err
+                else:
+                    pending.append((item, key, slot))
+            pending.sort(key=lambda p: p[2])
+            yield from _finish_stack(slab.array, pending, settings)
+            if next_wave < len(waves):
+                inflight.append((slab, submit(waves[next_wave], slab)))
+                next_wave += 1
+    except BrokenProcessPool:
+        _drop_process_pool()
+        raise
+    finally:
+        for slab in slabs:
+            slab.close()
+
+
+def collect_items(source):
+    """مجلد صور، أو ملف نصي بروابط/مسارات (سطر لكل عنصر)، أو قائمة جاهزة.
+    المجلد والملف النصي لسطر الأوامر فقط: لا يُمرر إليها مسار كتبه مستخدم التطبيق.
+    الملفات المرفوعة في القائمة (فيها getvalue) تُقرأ هنا فقط، عند بدء المعالجة"""
+    if isinstance(source, (list, tuple)):
+        items = (
+            s.strip() if isinstance(s, str) else (s.name, s.getvalue()) if hasattr(s, 'getvalue') else s
+            for s in source
+        )
+        return [s for s in items if s]
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(IMAGE_EXTS)
+        )
+    with open(source, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def run_batch(items, workers=None, **settings):
+    """يوزع العناصر على مجموعة العمليات ويعيد (العنصر، البايتات، الخطأ) فور انتهاء كل واحد"""
+    pool = get_process_pool(workers)
+    try:
+        futures = [pool.submit(_process_item, item, settings) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
+    except BrokenProcessPool:
+        _drop_process_pool()
+        raise
+
+
+def output_name(item, index, fmt='jpeg'):
+    stem = os.path.splitext(os.path.basename(item.split('?')[0]))[0] or 'image'
+    return f"{index:04d}-{stem}.{output_ext(fmt)}"
+
+
+def write_zip(results, fp, fmt='jpeg', progress=None):
+    """يكتب كل نتيجة في الأرشيف فور وصولها ثم يتركها، فلا تجتمع كل الصور في الذاكرة.
+    يعيد (عدد الناجحة، قائمة الأخطاء)"""
+    ok, errors = 0, []
+    # الصور مضغوطة أصلاً: التخزين بدون ضغط أسرع ولا يكبر الحجم
+    with zipfile.ZipFile(fp, 'w', zipfile.ZIP_STORED) as zf:
+        for done, (item, data, err) in enumerate(results, 1):
+            if err:
+                errors.append((item, err))
+            else:
+                zf.writestr(output_name(item, done, fmt), data)
+                ok += 1
+            if progress:
+                progress(done)
+    return ok, errors
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="معالجة دفعة صور بنفس إعدادات المحرر")
+    p.add_argument('source', help="مجلد صور أو ملف نصي فيه رابط/مسار في كل سطر")
+    p.add_argument('-o', '--out', default='processed', help="مجلد الإخراج")
+    p.add_argument('--crop', type=float, default=0.12, help="نسبة قص الشريط السفلي (0 = بدون)")
+    p.add_argument('--auto-crop', action='store_true', help="كشف شريط اللوغو وعلامات الزوايا (قوالب EDITOR_WATERMARK_DIR) من كل صورة بدل --crop")
+    p.add_argument('--smart-crop', action='store_true', help="نافذة القص حيث الموضوع بدل الوسط")
+    p.add_argument('--no-mirror', action='store_true')
+    p.add_argument('--red', type=float, default=0.08)
+    p.add_argument('--format', default='jpeg')
+    p.add_argument('--quality', type=int, default=95)
+    p.add_argument('--max-kb', type=int, default=0)
+    p.add_argument('-j', '--workers', type=int, default=None)
+    p.add_argument('--stacked', action='store_true', help="الألوان على مكدسات (N, 432, 768, 3) بدل صورة بصورة")
+    p.add_argument('--batch-mb', type=int, default=None, help="سقف ذاكرة المكدس الواحد")
+    p.add_argument('--auto-enhance', action='store_true', help="الإضاءة والتباين والتشبع من إحصاءات كل صورة")
+    args = p.parse_args(argv)
+    if args.stacked and args.auto_enhance:
+        # المكدس يطبق نفس العوامل على كل الصور، والتلقائي يختلف من صورة لأخرى
+        p.error("--auto-enhance لا يعمل مع --stacked")
+    if args.format.lower() not in available_formats() + ['png']:
+        # الملفات تُسمى بامتداد الصيغة المطلوبة: لا ترميز بصيغة أخرى تحت اسمها
+        p.error(f"الصيغة {args.format} غير متاحة في Pillow المثبتة ({', '.join(available_formats() + ['png'])})")
+
+    if args.auto_crop and not watermark_templates():
+        print(f"تنبيه: لا قوالب علامات مائية في {WATERMARK_DIR}، --auto-crop يكشف الشريط فقط", file=sys.stderr)
+
+    items = collect_items(args.source)
+    os.makedirs(args.out, exist_ok=True)
+    index = {item: i for i, item in enumerate(items)}
+    enc = dict(fmt=args.format, quality=args.quality, max_bytes=args.max_kb * 1024 or None)
+
+    ok = 0
+    start = time.perf_counter()
+    settings = dict(
+        crop=AUTO_CROP if args.auto_crop else args.crop, smart=args.smart_crop,
+        mirror=not args.no_mirror, red=args.red, enc=enc, auto=args.auto_enhance,
+    )
+    if args.stacked:
+        results = run_batch_stacked(items, args.workers, (args.batch_mb or 0) * 1024 * 1024 or None, **settings)
+    else:
+        results = run_batch(items, args.workers, **settings)
+    for item, data, err in results:
+        if err:
+            print(f"✗ {item}: {err}", file=sys.stderr)
+            continue
+        with open(os.path.join(args.out, output_name(item, index[item], args.format)), 'wb') as f:
+            f.write(data)
+        ok += 1
+        over = enc['max_bytes'] and len(data) > enc['max_bytes']
+        print(f"✓ {item}" + (f" (⚠ {len(data) >> 10} KB فوق --max-kb)" if over else ""))
+    elapsed = time.perf_counter() - start
+    print(f"{ok}/{len(items)} صورة في {elapsed:.1f} ث ({ok / elapsed if elapsed else 0:.2f} صورة/ث)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# --- ذاكرة الصور النهائية على القرص (مفتاحها: بصمة المصدر + كل الإعدادات) ---
+
+CACHE_DIR = os.environ.get(
+    "EDITOR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "driouchcity-editor")
+)
+CACHE_MAX_BYTES = int(os.environ.get("EDITOR_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# بكسلات المصادر المفكوكة (ملفات .npy تُربط بالذاكرة) في مجلد مستقل بحده الخاص
+PIXEL_CACHE_DIR = os.environ.get("EDITOR_PIXEL_CACHE_DIR", CACHE_DIR.rstrip(os.sep) + "-pixels")
+PIXEL_CACHE_MAX_BYTES = int(os.environ.get("EDITOR_PIXEL_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# نسخة خوارزميات image_engine: تُرفع مع كل تغيير في نتائجها فلا تُخدم صور قديمة من الذاكرة
+ENGINE_VERSION = 4
+
+# المسح الكامل للمجلد عند تجاوز تقدير الحجم فقط، أو مرة كل هذا العدد من الكتابات
+# (التقدير لكل عملية، فكتابات العمليات الأخرى تظهر في المسح الدوري)
+EVICT_EVERY = 64
+# الإخلاء ينزل إلى هذه النسبة من الحد لا إلى الحد نفسه، فلا تطلب كل كتابة تالية مسحاً جديداً
+EVICT_LOW_WATER = 0.9
+_usage = {}
+
+
+def cache_key(source_bytes, **params):
+    """بصمة SHA-256 لبايتات المصدر مع كل إعدادات المعالجة والترميز ونسخة المحرك"""
+    h = hashlib.sha256(source_bytes)
+    h.update(json.dumps(dict(params, engine=ENGINE_VERSION), sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _path(key, cache_dir):
+    # مجلدات فرعية بأول حرفين لتفادي آلاف الملفات في مجلد واحد
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def cache_get(key, cache_dir=None):
+    """يعيد البايتات المحفوظة أو None، ويحدث وقت الاستعمال (LRU)"""
+    path = _path(key, cache_dir or CACHE_DIR)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except OSError:
+        return None
+
+
+def cache_put(key, data, cache_dir=None, max_bytes=None):
+    """كتابة ذرية (ملف مؤقت + os.replace) آمنة مع عدة عمليات، ثم الإخلاء حسب الحجم"""
+    cache_dir = cache_dir or CACHE_DIR
+    path = _path(key, cache_dir)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        return
+    _account(cache_dir, max_bytes or CACHE_MAX_BYTES, len(data))
+
+
+def pixels_get(key, cache_dir=None):
+    """مصفوفة البكسلات مربوطة بالذاكرة (للقراءة فقط) أو None، دون فك ترميز ولا نسخ"""
+    path = _path(key, cache_dir or PIXEL_CACHE_DIR) + ".npy"
+    try:
+        pixels = np.load(path, mmap_mode="r")
+        os.utime(path)
+        return pixels
+    except (OSError, ValueError):
+        return None
+
+
+def pixels_put(key, pixels, cache_dir=None, max_bytes=None):
+    """نفس الكتابة الذرية لـ cache_put، بصيغة .npy قابلة للربط"""
+    cache_dir = cache_dir or PIXEL_CACHE_DIR
+    path = _path(key, cache_dir) + ".npy"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(pixels))
+        os.replace(tmp, path)
+    except OSError:
+        return
+    _account(cache_dir, max_bytes or PIXEL_CACHE_MAX_BYTES, os.path.getsize(path))
+
+
+def _account(cache_dir, max_bytes, added):
+    # يضيف الملف الجديد إلى تقدير الحجم، ويمسح المجلد فقط عند الحاجة
+    total, puts = _usage.get(cache_dir, (None, 0))
+    puts += 1
+    if total is None or total + added > max_bytes or puts >= EVICT_EVERY:
+        total, puts = _evict(cache_dir, max_bytes), 0
+    else:
+        total += added
+    _usage[cache_dir] = (total, puts)
+
+
+def _evict(cache_dir, max_bytes):
+    # عند تجاوز الحد: حذف الأقدم استعمالاً حتى ينزل الحجم إلى EVICT_LOW_WATER منه، ويعيد الحجم الباقي
+    entries = []
+    total = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= max_bytes:
+        return total
+    entries.sort()
+    target = max_bytes * EVICT_LOW_WATER
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            # عملية أخرى حذفته قبلنا
+            pass
+        total -= size
+        if total <= target:
+            break
+    return total
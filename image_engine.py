@@ -0,0 +1,1245 @@
+import io
+import math
+import os
+import threading
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import requests
+from PIL import Image, ImageEnhance, ImageOps, ImageStat, TiffImagePlugin, features
+
+from image_cache import cache_key, pixels_get, pixels_put
+
+# --- محرك الصور المشترك بين نسخ المحرر ---
+
+TARGET_SIZE = (768, 432)
+
+
+# قيمة القص التي تطلب كشف شريط اللوغو من الصورة نفسها بدل نسبة ثابتة
+AUTO_CROP = 'auto'
+
+
+def plan_cover_box(src_size, target_size=TARGET_SIZE, crop_bottom=0.0, crop_top=0.0):
+    """يحسب مربع المصدر الذي يبقى بعد قص اللوغو والقص المركزي (Cover)"""
+    src_w, src_h = src_size
+    target_w, target_h = target_size
+
+    # 1. قص اللوغو من الأسفل (ومن الأعلى إن كان الشريط هناك)
+    kept_h = int(src_h * (1 - crop_bottom)) if crop_bottom else src_h
+    kept_top = int(src_h * crop_top) if crop_top else 0
+    kept_h -= kept_top
+
+    # 2. القص المركزي لملء الإطار
+    if src_w / kept_h > target_w / target_h:
+        box_w = kept_h * target_w / target_h
+        left = (src_w - box_w) / 2
+        return (left, kept_top, left + box_w, kept_top + kept_h)
+    box_h = src_w * target_h / target_w
+    top = kept_top + (kept_h - box_h) / 2
+    return (0, top, src_w, top + box_h)
+
+
+def detect_logo_band(img, max_band=0.25, width=128):
+    """يكشف شريط اللوغو/الكتابة في أسفل الصورة أو أعلاها على نسخة رمادية بعرض ~128px.
+    الشريط = حافة أفقية تقطع معظم العرض + منطقة بعدها أغلب بكسلاتها بلون واحد.
+    يعيد (نسبة الأسفل، نسبة الأعلى)، و(0، 0) إن لم يوجد شريط.
+    plan_cover يمرر نسخة الكشف المصغرة (detection_proxy) لا الصورة الكاملة"""
+    factor = max(1, img.width // width)
+    small = img.reduce(factor) if factor > 1 else img
+    g = np.asarray(small.convert('L'), np.float32)
+    rows = g.shape[0]
+    limit = max(2, int(rows * max_band))
+    # jump[y - 1]: نسبة الأعمدة التي تقفز إضاءتها بين الصف y-1 والصف y
+    jump = (np.abs(g[1:] - g[:-1]) > 16).mean(axis=1)
+
+    def flat(band):
+        return (np.abs(band - np.median(band)) <= 10).mean() >= 0.6
+
+    bottom = top = 0.0
+    # أبعد حافة عن الطرف: الشريط كله بما فيه خطوطه الداخلية
+    for y in range(rows - limit, rows - 1):
+        if jump[y - 1] >= 0.6 and flat(g[y:]):
+            bottom = (rows - y + 0.5) / rows
+            break
+    # في الأعلى شرط أشد: السماء الصافية فوق الأفق تشبه الشريط
+    for y in range(limit, 1, -1):
+        if jump[y - 1] >= 0.8 and flat(g[:y]):
+            top = (y + 0.5) / rows
+            break
+    return min(bottom, max_band), min(top, max_band)
+
+
+# --- العلامات المائية في الزوايا: قوالب محلية وارتباط متقاطع عبر FFT ---
+
+# مجلد القوالب (PNG بشفافية أو صورة مقصوصة للعلامة كما تظهر)، انظر watermarks/README.md.
+# المستودع لا يضم قوالب (شعارات الوكالات ليست لنا): بدونها يكشف AUTO_CROP الشريط فقط
+WATERMARK_DIR = os.environ.get(
+    "EDITOR_WATERMARK_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "watermarks")
+)
+WATERMARK_WIDTH = 384
+# كل زاوية 128x64 من الإضاءة بعرض 384px (علامات الزوايا عريضة وقصيرة)، والقالب بعرض 6%-30% من الصورة بخطوة 6%:
+# فرق 4% في العرض يكفي لتنزل درجة القالب الصحيح إلى نصفها تقريباً (الحروف تنزاح بكسلات عند الطرف)
+_CORNER_W, _CORNER_H = 128, 64
+_WATERMARK_SCALES = tuple(round(0.06 * 1.06 ** i, 4) for i in range(28))
+# الدرجة = NCC × جذر عدد بكسلات القالب: أقصى NCC على صورة بلا علامة يكبر كلما صغر القالب،
+# فالجذر يجعل عتبة واحدة صالحة لكل المقاييس. المعايرة (7 علامات نصية، شفافية 35%-70%، عرض 8%-28%):
+# الزوايا النظيفة ≤6.5 على خلفيات بطيف 1/f و~10.5 على زوايا مليئة بالكتابة؛ العلامة بعرض 20%+
+# تتجاوز العتبة في ~85% من الحالات و15% في ~60%، وتحت 12% غالباً لا (حروف بعرض بكسل عند 384px)
+WATERMARK_THRESHOLD = 11.0
+_TEMPLATE_EXTS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+def _high_pass(a, radius=1):
+    # طرح متوسط صندوقي (عبر جدول المجاميع): تبقى الحروف والحواف وتختفي خلفية الصورة الناعمة
+    k = 2 * radius + 1
+    p = np.pad(a, radius + 1, mode='edge')
+    c = p.cumsum(0).cumsum(1)
+    box = c[k:, k:] - c[:-k, k:] - c[k:, :-k] + c[:-k, :-k]
+    return a - box[:a.shape[0], :a.shape[1]] / (k * k)
+
+
+def watermark_fingerprint(path=None):
+    """(الاسم، الحجم، mtime) لكل قالب في المكتبة، أو () إن لم يوجد المجلد.
+    يتغير بإضافة قالب أو حذفه أو استبداله في مكانه (mtime المجلد لا يتغير مع الاستبدال)"""
+    path = path or WATERMARK_DIR
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return ()
+    stamps = []
+    for name in names:
+        if not name.lower().endswith(_TEMPLATE_EXTS):
+            continue
+        try:
+            info = os.stat(os.path.join(path, name))
+        except OSError:
+            continue
+        stamps.append((name, info.st_size, info.st_mtime_ns))
+    return tuple(stamps)
+
+
+def crop_params(crop):
+    """معاملات القص في مفاتيح الذاكرة ومراحل الجلسة: نتيجة AUTO_CROP تتبع مكتبة القوالب أيضاً"""
+    if crop == AUTO_CROP:
+        return dict(crop=crop, watermarks=watermark_fingerprint())
+    return dict(crop=crop)
+
+
+def watermark_templates(path=None):
+    """أطياف قوالب المكتبة، محسوبة مرة واحدة لكل عملية وتُعاد لكل صور الدفعة.
+    تُحسب من جديد فقط إذا تغير أحد القوالب"""
+    path = path or WATERMARK_DIR
+    stamps = watermark_fingerprint(path)
+    return _template_spectra(path, stamps) if stamps else ()
+
+
+@lru_cache(maxsize=4)
+def _template_spectra(path, stamps):
+    # (الاسم، (العرض، الارتفاع)، conj(FFT القالب)، طول القالب)
+    spectra = []
+    shape = (_CORNER_H, _CORNER_W)
+    for name, _, _ in stamps:
+        try:
+            tmpl = Image.open(os.path.join(path, name))
+            tmpl.load()
+        except OSError:
+            continue
+        alpha = tmpl.getchannel('A') if 'A' in tmpl.getbands() else None
+        lum = tmpl.convert('L')
+        for scale in _WATERMARK_SCALES:
+            tw = round(WATERMARK_WIDTH * scale)
+            th = max(1, round(tw * tmpl.height / tmpl.width))
+            if th > _CORNER_H:
+                continue
+            t = np.asarray(lum.resize((tw, th), Image.BOX), np.float64)
+            if alpha:
+                # العلامة الشفافة تزيح البكسلات نحو لونها بقدر الشفافية: الشكل هو الإشارة
+                # (موجبة للحروف الفاتحة وسالبة للداكنة)
+                t = np.asarray(alpha.resize((tw, th), Image.BOX), np.float64) / 255 * (t - 128)
+            if tw * th < 16:
+                continue
+            # القالب بمتوسط صفري: البسط يصبح ارتباطاً مباشراً
+            t = _high_pass(t)
+            t -= t.mean()
+            norm = float(np.sqrt((t * t).sum()))
+            if norm < 1e-3:
+                # قالب بلون واحد لا يمكن تمييزه
+                continue
+            # float32: نصف زمن FFT ولا فرق يذكر في الدرجة
+            spectra.append((os.path.splitext(name)[0], (tw, th), np.conj(np.fft.rfft2(t.astype(np.float32), shape)), norm))
+    return tuple(spectra)
+
+
+def detection_proxy(img):
+    """نسخة بعرض WATERMARK_WIDTH إلى ضعفه تقريباً (reduce بعامل صحيح) يعمل عليها كشف الشريط والعلامات.
+    التصغير يقرأ كل بكسلات الصورة: مرة واحدة لكل صورة، لا مرة لكل كاشف"""
+    factor = max(1, img.width // WATERMARK_WIDTH)
+    return img.reduce(factor) if factor > 1 else img
+
+
+def find_watermarks(img, templates=None, threshold=WATERMARK_THRESHOLD):
+    """يبحث عن قوالب المكتبة في الزوايا الأربع بالارتباط المتقاطع المُطبَّع (NCC) عبر FFT
+    على إضاءة بعرض 384px، ويبقي لكل زاوية أفضل قالب ومقياس فقط (الدرجة كما في WATERMARK_THRESHOLD).
+    الكلفة ~25 ms لكل ملف قالب (28 مقياساً)، تُضاف لكل صورة بـ AUTO_CROP.
+    يعيد [(الاسم، الدرجة، (x0, y0, x1, y1) كنسب من الصورة)]"""
+    templates = watermark_templates() if templates is None else templates
+    gw = WATERMARK_WIDTH
+    gh = round(gw * img.height / img.width)
+    if not templates or gh < _CORNER_H:
+        return []
+    small = detection_proxy(img)
+    g = _high_pass(np.asarray(small.convert('L').resize((gw, gh), Image.BOX), np.float64))
+    cw, ch = _CORNER_W, _CORNER_H
+    shape = (ch, cw)
+
+    found = []
+    for cx, cy in ((0, 0), (gw - cw, 0), (0, gh - ch), (gw - cw, gh - ch)):
+        patch = g[cy:cy + ch, cx:cx + cw]
+        # طيف الزاوية مرة واحدة لكل القوالب؛ المواضع الصالحة لا تلتف فلا حاجة للحشو
+        spectrum = np.fft.rfft2(patch.astype(np.float32))
+        # مجموع ومجموع مربعات كل نافذة من جدولي المجاميع: المقام O(1) لكل موضع
+        sums, squares = (np.pad(a.cumsum(0).cumsum(1), ((1, 0), (1, 0))) for a in (patch, patch * patch))
+        best = (-np.inf,)
+        for name, (tw, th), ft, norm in templates:
+            rows, cols = ch - th + 1, cw - tw + 1
+            num = np.fft.irfft2(spectrum * ft, shape)[:rows, :cols]
+            s1, s2 = (
+                t[th:th + rows, tw:tw + cols] - t[:rows, tw:tw + cols] - t[th:th + rows, :cols] + t[:rows, :cols]
+                for t in (sums, squares)
+            )
+            count = tw * th
+            var = s2 - s1 * s1 / count
+            # المناطق شبه المتجانسة (انحراف < 2 بعد إزالة الخلفية) لا تُقارن
+            score = np.where(var > 4 * count, num * np.sqrt(count / np.maximum(var, 1e-9)) / norm, 0.0)
+            u, v = np.unravel_index(np.argmax(score), score.shape)
+            if score[u, v] > best[0]:
+                best = (float(score[u, v]), name, tw, th, u, v)
+        if best[0] >= threshold:
+            score, name, tw, th, u, v = best
+            # هامش احتياطي: العلامة الحقيقية قد تكون أكبر قليلاً من أقرب مقياس
+            px, py = tw // 6 + 2, th // 4 + 2
+            x0, y0 = cx + v - px, cy + u - py
+            found.append((name, score, (
+                max(0.0, x0 / gw), max(0.0, y0 / gh),
+                min(1.0, (x0 + tw + 2 * px) / gw), min(1.0, (y0 + th + 2 * py) / gh),
+            )))
+    return found
+
+
+def smart_cover_box(image, target_size=TARGET_SIZE, crop_bottom=0.0, crop_top=0.0, src_size=None, width=160,
+                    exclude=(), by_energy=True):
+    """مثل plan_cover_box (نفس الأبعاد) لكن النافذة حيث تتركز الحواف (الوجوه، الموضوع) بدل الوسط.
+    طاقة الحواف على نسخة مصغرة، وجدول المجاميع (summed-area table) يجعل كل نافذة O(1).
+    image قد تكون نسخة مصغرة من مصدر بأبعاد src_size، والمربع يعود بإحداثيات المصدر.
+    exclude: مناطق (نسب من الصورة) لا تدخل النافذة؛ None إن لم تتسع الصورة لتجنبها.
+    by_energy=False: أقرب نافذة للوسط تتجنب المناطق فقط"""
+    src_w, src_h = src_size or image.size
+    x0, y0, x1, y1 = plan_cover_box((src_w, src_h), target_size, crop_bottom, crop_top)
+    factor = max(1, image.width // width)
+    small = image.reduce(factor) if factor > 1 else image
+    g = np.asarray(small.convert('L'), np.float32)
+    energy = np.zeros_like(g)
+    if by_energy:
+        energy[:, 1:] += np.abs(np.diff(g, axis=1))
+        energy[1:] += np.abs(np.diff(g, axis=0))
+    sat = np.zeros((g.shape[0] + 1, g.shape[1] + 1), np.float64)
+    sat[1:, 1:] = energy.cumsum(0).cumsum(1)
+
+    # النافذة تملأ أحد المحورين، فالانزلاق على الآخر فقط وفي حدود المنطقة بعد قص الشريط
+    sx, sy = g.shape[1] / src_w, g.shape[0] / src_h
+    w, h = max(1, round((x1 - x0) * sx)), max(1, round((y1 - y0) * sy))
+    kept_top = int(src_h * crop_top) if crop_top else 0
+    kept_bottom = int(src_h * (1 - crop_bottom)) if crop_bottom else src_h
+    xs = np.arange(0, max(0, g.shape[1] - w) + 1)
+    ys = np.arange(round(kept_top * sy), max(round(kept_top * sy), round(kept_bottom * sy) - h) + 1)
+    ya, xa = ys[:, None], xs[None, :]
+    score = sat[ya + h, xa + w] - sat[ya, xa + w] - sat[ya + h, xa] + sat[ya, xa]
+
+    # ميل خفيف نحو الوسط: الصور المتجانسة تبقى على القص المركزي
+    cx, cy = (xs - xs.mean()) / max(1, np.ptp(xs)), (ys - ys.mean()) / max(1, np.ptp(ys))
+    score = (score + 1) * (1 - 0.15 * (np.abs(cy)[:, None] + np.abs(cx)[None, :]))
+    for rx0, ry0, rx1, ry1 in exclude:
+        # نافذة تتقاطع مع المنطقة على المحورين معاً مستبعدة
+        hit_x = (xa < rx1 * g.shape[1]) & (xa + w > rx0 * g.shape[1])
+        hit_y = (ya < ry1 * g.shape[0]) & (ya + h > ry0 * g.shape[0])
+        score = np.where(hit_x & hit_y, -1.0, score)
+    by, bx = np.unravel_index(np.argmax(score), score.shape)
+    if score[by, bx] < 0:
+        return None
+    if by == np.argmin(np.abs(cy)) and bx == np.argmin(np.abs(cx)):
+        # نافذة الوسط نفسها: المربع الدقيق بدل تقريب النسخة المصغرة
+        return (x0, y0, x1, y1)
+    dx = min(max(float(xs[bx]) / sx, 0), src_w - (x1 - x0)) - x0
+    dy = min(max(float(ys[by]) / sy, kept_top), kept_bottom - (y1 - y0)) - y0
+    return (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+
+
+def plan_cover(image, target_size=TARGET_SIZE, crop_bottom=0.0, smart=False, src_size=None):
+    """مربع القص النهائي من البكسلات: نسبة ثابتة، أو AUTO_CROP (الشريط المكشوف + العلامات المائية
+    في الزوايا)، ثم النافذة في الوسط أو حيث الموضوع. image قد تكون نسخة مصغرة من src_size"""
+    src_size = src_size or image.size
+    crop_top, exclude = 0.0, []
+    if crop_bottom == AUTO_CROP:
+        proxy = detection_proxy(image)
+        crop_bottom, crop_top = detect_logo_band(proxy)
+        exclude = [region for _, _, region in find_watermarks(proxy)]
+    if not (smart or exclude):
+        return plan_cover_box(src_size, target_size, crop_bottom, crop_top)
+    box = smart_cover_box(image, target_size, crop_bottom, crop_top, src_size, exclude=exclude, by_energy=smart)
+    if box is None:
+        # لا نافذة تتجنب كل العلامات: يتسع قص الشريط من جهتها حتى يتجاوزها،
+        # ما دام نصف الارتفاع على الأقل باقياً؛ وإلا تبقى العلامة ويُكتفى بقص الشريط
+        bottom, top = crop_bottom, crop_top
+        for _, ry0, _, ry1 in exclude:
+            if ry0 + ry1 > 1:
+                bottom = max(bottom, 1 - ry0)
+            else:
+                top = max(top, ry1)
+        if bottom + top <= 0.5:
+            crop_bottom, crop_top = bottom, top
+        box = smart_cover_box(image, target_size, crop_bottom, crop_top, src_size, by_energy=smart)
+    return box
+
+
+def render_cover(image, target_size=TARGET_SIZE, crop_bottom=0.0, mirror=False, smart=False):
+    """قص + تغيير أبعاد في عملية إعادة تحجيم واحدة، والقلب على الصورة الصغيرة.
+    crop_bottom = AUTO_CROP يكشف الشريط والعلامات المائية من الصورة نفسها، وsmart يختار النافذة بدل الوسط"""
+    box = plan_cover(image, target_size, crop_bottom, smart)
+    img = image.resize(target_size, Image.LANCZOS, box=box)
+    if mirror:
+        img = ImageOps.mirror(img)
+    return img
+
+
+# --- المصادر المتحركة (GIF/WebP/APNG): إطار واحد فقط، لا الحركة كلها ---
+
+ANIMATION_MAX_FRAMES = 8
+# مجموع بكسلات الإطارات المفحوصة: اللافتات الضخمة تُفحص منها إطارات أقل
+ANIMATION_PIXEL_BUDGET = 16_000_000
+
+
+def select_frame(img, max_frames=ANIMATION_MAX_FRAMES, pixel_budget=ANIMATION_PIXEL_BUDGET):
+    """للمصدر المتحرك: يفك أول بضعة إطارات بالتسلسل (GIF/WebP لا تسمح بالقفز) ويقيّم كل إطار
+    بتباين إضاءة نسخة ~64px، ثم يعيد الأوضح RGB. لا يُفك شيء بعد آخر إطار مفحوص، ولا يبقى
+    في الذاكرة إلا الإطار الحالي والأفضل. غير المتحرك يعود كما هو"""
+    if not getattr(img, 'is_animated', False):
+        return img
+    frames = max(1, min(max_frames, pixel_budget // (img.width * img.height)))
+    best, best_score = None, -1.0
+    for index in range(frames):
+        try:
+            img.seek(index)
+        except EOFError:
+            break
+        frame = img.convert('RGB')
+        thumb = frame.reduce(max(1, frame.width // 64)).convert('L')
+        score = ImageStat.Stat(thumb).stddev[0]
+        # إطار البداية (تلاشٍ، خلفية فارغة) يُترك فقط إذا كان غيره أوضح بفارق
+        if score > best_score * 1.1:
+            best, best_score = frame, score
+    return best
+
+
+def open_for_target(fp, target_size=TARGET_SIZE, crop_bottom=0.0):
+    """فتح الصورة مع فك JPEG بأصغر مقياس DCT يكفي للأبعاد النهائية، وتصحيح اتجاه EXIF.
+    المصادر المتحركة: الإطار المختار فقط (select_frame)"""
+    img = Image.open(fp)
+    if getattr(img, 'is_animated', False):
+        # لا draft ولا اتجاه EXIF في هذه الصيغ
+        return select_frame(img)
+    # صور الهاتف المدورة (الاتجاه 5-8): الأبعاد الظاهرة معكوسة
+    orientation = img.getexif().get(0x0112, 1)
+    shown = img.size[::-1] if orientation in (5, 6, 7, 8) else img.size
+    box = plan_cover_box(shown, target_size, crop_bottom)
+    scale = target_size[0] / (box[2] - box[0])
+    if scale < 1:
+        # draft لا يفعل شيئاً مع غير JPEG، ويختار 1/2 أو 1/4 أو 1/8 دون النزول تحت المطلوب
+        img.draft(img.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    if orientation != 1:
+        # التدوير بعد draft: على الصورة المصغرة فقط
+        img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def decode_cached(data, target_size=TARGET_SIZE, crop_bottom=0.0):
+    """open_for_target عبر ذاكرة البكسلات على القرص: نفس المصدر بنفس المقياس يُربط (memmap) دون فك"""
+    key = cache_key(data, decode=target_size, crop=crop_bottom)
+    pixels = pixels_get(key)
+    if pixels is not None:
+        return Image.fromarray(pixels)
+    img = open_for_target(io.BytesIO(data), target_size, crop_bottom)
+    pixels_put(key, np.asarray(img))
+    return img
+
+
+# --- مسار محدود الذاكرة للصور الضخمة (50+ ميغابكسل): فك وتصغير بشرائح أفقية ---
+
+LARGE_IMAGE_PIXELS = 24_000_000
+MEMORY_CAP = int(os.environ.get("EDITOR_MEMORY_CAP_MB", "256")) * 1024 * 1024
+
+# بايتات كل بكسل في الصيغ الخام القابلة للتقسيم
+_RAW_PIXEL_BYTES = {'RGB': 3, 'BGR': 3, 'RGBA': 4, 'RGBX': 4, 'BGRA': 4, 'BGRX': 4, 'L': 1, 'P': 1, 'CMYK': 4}
+# صفوف PNG بـ 8 بت فقط: الصف الأخير من كل شريحة يُعاد ترميزه كما كان دون فقد
+_PNG_PIXEL_BYTES = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4, 'P': 1}
+# وسوم TIFF التي يحتاجها libtiff لفك شرائح منسوخة في ملف صغير مستقل
+_TIFF_STRIP_TAGS = (256, 257, 258, 259, 262, 273, 277, 278, 279, 284, 317, 320, 338, 339, 347, 529, 530, 532)
+
+
+def _buffer_bytes(mode, size):
+    # حجم الصورة داخل PIL: بايت لكل بكسل للصيغ الأحادية و4 لغيرها (RGB يُخزن 32 بت)
+    return size[0] * size[1] * (1 if mode in ('1', 'L', 'P') else 4)
+
+
+def is_large_source(fp, limit=LARGE_IMAGE_PIXELS):
+    """يقرأ الترويسة فقط ويقرر هل الصورة تحتاج المسار محدود الذاكرة"""
+    with Image.open(fp) as img:
+        return img.width * img.height > limit and img.format != 'JPEG'
+
+
+def _raw_strip_tiles(img):
+    # كل بلاطة raw تتحول إلى (y0, y1, x0, x1, offset, rawmode, stride, ystep) لتقسيمها بالصفوف
+    tiles = []
+    for tile in img.tile:
+        codec, (x0, y0, x1, y1), offset, args = tile
+        rawmode, stride, ystep = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+        if codec != 'raw' or rawmode not in _RAW_PIXEL_BYTES:
+            return None
+        stride = stride or (x1 - x0) * _RAW_PIXEL_BYTES[rawmode]
+        tiles.append((y0, y1, x0, x1, offset, rawmode, stride, ystep or 1))
+    # WebP مثلاً بلا بلاطات قبل الفك
+    return tiles or None
+
+
+def _load_rows(fp, tiles, width, y0, y1):
+    """يفك الصفوف [y0, y1) فقط من ملف بصيغة خام دون لمس باقي الملف"""
+    fp.seek(0)
+    strip = Image.open(fp)
+    sub = []
+    for ty0, ty1, tx0, tx1, offset, rawmode, stride, ystep in tiles:
+        a, b = max(ty0, y0), min(ty1, y1)
+        if a >= b:
+            continue
+        # الصفوف مخزنة من الأعلى (ystep=1) أو من الأسفل (BMP: ystep=-1)
+        first = a - ty0 if ystep == 1 else ty1 - b
+        sub.append(('raw', (tx0, a - y0, tx1, b - y0), offset + first * stride, (rawmode, stride, ystep)))
+    strip._size = (width, y1 - y0)
+    strip.tile = sub
+    strip.load()
+    return strip
+
+
+class _PngRows:
+    """صفوف PNG بالتسلسل (8 بت، بلا تشابك): IDAT يُفك عبر zlib بقدر الشريحة فقط، ومرشحات الصفوف
+    يفكها مفكك zip في PIL بعد صف غير مفلتر يحمل الصف السابق (مرجع Up/Average/Paeth).
+    الطلبات تتقدم مع الصورة، والتداخل بين شريحتين يؤخذ من الشريحة السابقة"""
+
+    def __init__(self, fp, img):
+        tile = img.tile[0]
+        self.fp, self.mode, self.rawmode, self.width = fp, img.mode, tile.args, img.width
+        self.stride = img.width * _PNG_PIXEL_BYTES[self.rawmode]
+        self.palette = img.palette
+        self.z = zlib.decompressobj()
+        # الإزاحة في البلاطة بعد ترويسة أول IDAT
+        self.pos, self.left = tile.offset - 8, 0
+        self.prior = bytes(self.stride)
+        self.y, self.seg, self.seg_y = 0, None, 0
+
+    def _idat(self, size=1 << 20):
+        # القطعة التالية من بيانات IDAT المضغوطة (عبر حدود المقاطع)
+        while not self.left:
+            self.fp.seek(self.pos)
+            head = self.fp.read(8)
+            if len(head) < 8 or head[4:] != b'IDAT':
+                return b''
+            self.left = int.from_bytes(head[:4], 'big')
+            self.pos += 8
+        self.fp.seek(self.pos)
+        data = self.fp.read(min(size, self.left))
+        self.pos += len(data)
+        self.left -= len(data)
+        if not self.left:
+            # CRC
+            self.pos += 4
+        return data
+
+    def _decode(self, n):
+        need, filtered = n * (self.stride + 1), bytearray()
+        while len(filtered) < need:
+            data = self.z.unconsumed_tail or self._idat()
+            if not data:
+                raise OSError("بيانات PNG ناقصة")
+            filtered += self.z.decompress(data, need - len(filtered))
+        # zlib بلا ضغط (مستوى 0): نسخ سريع يقبله مفكك zip
+        stream = zlib.compress(b'\0' + self.prior + bytes(filtered), 0)
+        band = Image.frombytes(self.mode, (self.width, n + 1), stream, 'zip', self.rawmode)
+        self.prior = band.crop((0, n, self.width, n + 1)).tobytes('raw', self.rawmode)
+        self.y += n
+        return band.crop((0, 1, self.width, n + 1))
+
+    def __call__(self, y0, y1):
+        keep = None
+        if self.seg is not None and y0 < self.y:
+            keep = self.seg.crop((0, y0 - self.seg_y, self.width, self.y - self.seg_y))
+        self.seg = None
+        while self.y < y0:
+            # الصفوف قبل الشريحة تُفك (مرجع الصف التالي) وتُترك، بدفعات بحجم الشريحة
+            self._decode(min(y0 - self.y, max(1, y1 - y0)))
+        new = self._decode(y1 - self.y) if y1 > self.y else None
+        out = new if keep is None else keep
+        if keep is not None and new is not None:
+            out = Image.new(self.mode, (self.width, y1 - y0))
+            out.paste(keep, (0, 0))
+            out.paste(new, (0, keep.height))
+        if self.mode == 'P':
+            out.putpalette(self.palette.palette, self.palette.mode)
+        self.seg, self.seg_y = out, y0
+        return out
+
+
+def _tiff_strips(fp, img, s0, s1):
+    """الشرائح [s0, s1) من TIFF مضغوط (LZW، Deflate، PackBits...) كملف TIFF صغير مستقل:
+    نفس الوسوم والبيانات المضغوطة كما هي، فيفكها libtiff دون قراءة باقي الصورة"""
+    tags = img.tag_v2
+    rps = tags.get(278, img.height)
+    counts = tags[279][s0:s1]
+    order = 'little' if tags.prefix == b'II' else 'big'
+    magic = tags.prefix + (42).to_bytes(2, order)
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=magic + (8).to_bytes(4, order))
+    for tag in _TIFF_STRIP_TAGS:
+        if tag in tags:
+            ifd.tagtype[tag] = tags.tagtype[tag]
+            ifd[tag] = tags[tag]
+    ifd[257] = min(img.height, s1 * rps) - s0 * rps
+    ifd.tagtype[273] = ifd.tagtype[279] = 4
+    ifd[279] = tuple(counts)
+    # إزاحات نسبية: tobytes يضيف إليها نهاية الترويسة، والبيانات تُلحق بعدها مباشرة
+    ifd[273] = tuple(sum(counts[:i]) for i in range(len(counts)))
+    out = io.BytesIO()
+    out.write(magic + (8).to_bytes(4, order) + ifd.tobytes(8))
+    for offset, count in zip(tags[273][s0:s1], counts):
+        fp.seek(offset)
+        out.write(fp.read(count))
+    out.seek(0)
+    strips = Image.open(out)
+    strips.load()
+    return strips
+
+
+def _row_reader(fp, img):
+    """(read(y0, y1) -> صورة الصفوف، بايتات كل صف أثناء القراءة، بايتات ثابتة) أو None إن لم تُقرأ بشرائح"""
+    row = _buffer_bytes(img.mode, (img.width, 1))
+    tiles = _raw_strip_tiles(img)
+    if tiles is not None:
+        return (lambda y0, y1: _load_rows(fp, tiles, img.width, y0, y1)), row, 0
+    if img.format == 'PNG' and not img.info.get('interlace') and len(img.tile) == 1 \
+            and img.tile[0].args in _PNG_PIXEL_BYTES:
+        # الشريحة السابقة + المتداخل منها + الجديدة، والصفوف المفلترة + نسختها المغلفة بـ zlib
+        filtered = img.width * _PNG_PIXEL_BYTES[img.tile[0].args] + 1
+        return _PngRows(fp, img), 3 * row + 2 * filtered, 0
+    tags = getattr(img, 'tag_v2', None)
+    if img.format == 'TIFF' and not tags._bigtiff and 322 not in tags and tags.get(284, 1) == 1 \
+            and 273 in tags and 279 in tags and tags.get(278, img.height) < img.height:
+        rps = tags[278]
+        packed = -(-sum(tags[279]) // img.height)
+
+        def read(y0, y1):
+            s0 = y0 // rps
+            strips = _tiff_strips(fp, img, s0, -(-y1 // rps))
+            return strips.crop((0, y0 - s0 * rps, img.width, y1 - s0 * rps))
+
+        # المفكوك + المقصوص منه والمضغوط، وشريحتا TIFF زائدتان على الطرفين + مخزن libtiff لشريحة
+        return read, 2 * row + packed, 2 * rps * (row + packed) + rps * img.width * len(img.getbands())
+    return None
+
+
+def render_cover_bounded(fp, target_size=TARGET_SIZE, crop_bottom=0.0, mem_cap=None, smart=False):
+    """نفس render_cover لكن ذاكرة البكسلات تبقى تحت mem_cap حيث تسمح الصيغة:
+    الخام (TIFF غير مضغوط، BMP، PPM) وPNG بـ 8 بت وTIFF المضغوط بشرائح (strips) تُفك وتُصغر
+    شريحة بشريحة مع هامش لنواة LANCZOS. غيرها (أو سقف لا يتسع لشريحة) يُفك مرة واحدة كما قبل،
+    مع RuntimeWarning إن تجاوز السقف. تقدير الذروة (لا قياسها) في info['peak_estimate']"""
+    mem_cap = mem_cap or MEMORY_CAP
+    img = Image.open(fp)
+    box = None
+    if crop_bottom == AUTO_CROP or smart:
+        # الكشف واختيار النافذة على نسخة كاملة الإطار بعرض WATERMARK_WIDTH من نفس المسار المحدود، ثم القص الحقيقي
+        proxy_size = (WATERMARK_WIDTH, max(2, round(WATERMARK_WIDTH * img.height / img.width)))
+        proxy = render_cover_bounded(fp, proxy_size, 0.0, mem_cap)
+        box = plan_cover(proxy, target_size, crop_bottom, smart, src_size=img.size)
+        fp.seek(0)
+        img = Image.open(fp)
+    tw, th = target_size
+    bx0, by0, bx1, by1 = box or plan_cover_box(img.size, target_size, crop_bottom)
+    canvas_bytes = _buffer_bytes('RGB', target_size)
+    # الإطار المختار من مصدر متحرك لا يُقرأ بالشرائح
+    animated = getattr(img, 'is_animated', False)
+    reader = None if animated else _row_reader(fp, img)
+
+    band = 0
+    if reader is not None:
+        # كل صف مصدر: القراءة (+ تحويل لوحة الألوان إلى RGB) + مرور التحجيم الأفقي،
+        # والهامش يغطي نصف عرض النواة
+        read, row_bytes, fixed = reader
+        if img.mode in ('1', 'P'):
+            row_bytes += _buffer_bytes('RGB', (img.width, 1))
+        row_bytes += _buffer_bytes('RGB', (tw, 1))
+        sy = (by1 - by0) / th
+        margin = math.ceil(3 * max(sy, 1)) + 2
+        band_rows = int((mem_cap - 2 * canvas_bytes - fixed) // row_bytes) - 2 * margin
+        band = int(band_rows / sy)
+
+    if band < 1:
+        # فك كامل واحد، ثم التصغير قبل أي تحويل حتى لا تتكرر نسخة بالحجم الكامل
+        need = _buffer_bytes(img.mode, img.size) + _buffer_bytes('RGB', (tw, img.height)) + canvas_bytes
+        if animated:
+            # الإطارات بعد الأول تُفك RGBA، ويبقى مع الحالي تحويله RGB وأفضل إطار حتى الآن
+            need += 3 * _buffer_bytes('RGB', img.size)
+        elif img.mode in ('1', 'P'):
+            need += _buffer_bytes('RGB', img.size)
+        if need > mem_cap:
+            warnings.warn(
+                f"{img.format} بدون شرائح: فك كامل ≈{need >> 20} MB فوق سقف الذاكرة {mem_cap >> 20} MB",
+                RuntimeWarning, stacklevel=2,
+            )
+        if animated:
+            img = select_frame(img)
+        elif img.mode in ('1', 'P'):
+            img = img.convert('RGB')
+        out = img.resize(target_size, Image.LANCZOS, box=(bx0, by0, bx1, by1))
+        out = out.convert('RGB') if out.mode != 'RGB' else out
+        out.info['peak_estimate'] = need
+        return out
+
+    out = Image.new('RGB', target_size)
+    peak = 0
+    for oy0 in range(0, th, band):
+        oy1 = min(th, oy0 + band)
+        top, bottom = by0 + oy0 * sy, by0 + oy1 * sy
+        y0 = max(0, int(top) - margin)
+        y1 = min(img.height, math.ceil(bottom) + margin)
+        strip = read(y0, y1)
+        if strip.mode in ('1', 'P'):
+            # LANCZOS لا يعمل على لوحة الألوان
+            strip = strip.convert('RGB')
+        part = strip.resize((tw, oy1 - oy0), Image.LANCZOS, box=(bx0, top - y0, bx1, bottom - y0))
+        out.paste(part.convert('RGB') if part.mode != 'RGB' else part, (0, oy0))
+        peak = max(peak, row_bytes * (y1 - y0) + fixed + _buffer_bytes('RGB', part.size) + canvas_bytes)
+        del strip, part
+    out.info['peak_estimate'] = peak
+    return out
+
+
+# --- مصفوفة الألوان ((Brightness +) Color + Contrast في مرور واحد، والطبقة الملونة جدول بعدها) ---
+
+_LUMA = (0.299, 0.587, 0.114)
+
+
+def compile_color_matrix(saturation=1.0, contrast=1.0, mean=128, brightness=1.0):
+    """يحول إعدادات (Brightness ثم) Color ثم Contrast إلى مصفوفة 3x4 لـ Image.convert.
+    الطبقة الملونة ليست هنا: apply_tint بجدولها الدقيق بعد المصفوفة"""
+    # تعويض متوسط القطع (truncation) الذي تقوم به كل خطوة في ImageEnhance
+    bias = -0.5 * ((contrast if brightness != 1 else 0)
+                   + (contrast if saturation != 1 else 0)
+                   + (1 if contrast != 1 else 0))
+    matrix = []
+    for ch in range(3):
+        for k in range(3):
+            color_gain = saturation * (ch == k) + (1 - saturation) * _LUMA[k]
+            matrix.append(contrast * color_gain * brightness)
+        matrix.append((1 - contrast) * mean + bias)
+    return tuple(matrix)
+
+
+def _contrast_mean(img, saturation, brightness=1.0):
+    # متوسط الإضاءة الذي يحسبه ImageEnhance.Contrast، على نسخة مصغرة
+    proxy = img.reduce(4) if min(img.size) >= 64 else img
+    proxy = proxy.convert('RGB', compile_color_matrix(saturation, brightness=brightness))
+    return int(ImageStat.Stat(proxy.convert('L')).mean[0] + 0.5)
+
+
+def _tint_lut(tint_alpha, tint_color):
+    # جدول لكل قناة يطابق Image.blend مع لون ثابت
+    lut = []
+    for c in tint_color:
+        lut.extend(int(v + tint_alpha * (c - v)) for v in range(256))
+    return lut
+
+
+def _blend_lut(factor, base):
+    # Image.blend(لون ثابت base، الصورة، factor) كجدول: نفس حساب float32 والقطع في C
+    t = np.float32(base) + np.float32(factor) * (np.arange(256) - base).astype(np.float32)
+    return np.clip(t, 0, 255).astype(np.uint8).tolist()
+
+
+def _color_contrast_exact(img, saturation, contrast, brightness=1.0):
+    """(Brightness ->) Color -> Contrast بنفس قطع ImageEnhance بعد كل خطوة (نتيجة مطابقة):
+    Color هو نفس blend مع الرمادي، وBrightness وContrast جدولان من المتوسط الدقيق"""
+    img = img.convert('RGB')
+    if brightness != 1:
+        img = img.point(_blend_lut(brightness, 0) * 3)
+    if saturation != 1:
+        img = Image.blend(img.convert('L').convert('RGB'), img, saturation)
+    if contrast != 1:
+        mean = int(ImageStat.Stat(img.convert('L')).mean[0] + 0.5)
+        img = img.point(_blend_lut(contrast, mean) * 3)
+    return img
+
+
+def enhance_colors(img, saturation, contrast, tint_alpha=0.0, tint_color=(180, 20, 20), sharpness=None,
+                   brightness=1.0, auto=False):
+    """بديل سريع لسلسلة (Brightness ->) Color -> Contrast -> (Sharpness) -> blend مع طبقة لونية.
+    auto: العوامل من إحصاءات الصورة (auto_factors) بدل الثوابت كما هي"""
+    if auto:
+        stats = image_stats(img)
+        saturation, contrast, brightness = auto_factors(stats, saturation, contrast)
+    if sharpness is None:
+        if auto:
+            # Color لا يغير متوسط الإضاءة: متوسط Contrast من نفس الإحصاءات دون مرور ثانٍ
+            mean = int(min(stats[0] * brightness, 255) + 0.5)
+        else:
+            mean = _contrast_mean(img, saturation, brightness)
+        # Color + Contrast في مصفوفة واحدة (±1 درجة)، والطبقة الملونة جدولها الدقيق بعدها:
+        # ثلاث عمليات قطع لا يعوضها انحياز واحد دون فرق درجتين أحياناً
+        img = img.convert('RGB', compile_color_matrix(saturation, contrast, mean, brightness=brightness))
+        return apply_tint(img, tint_alpha, tint_color)
+
+    # الحدة تضخم كل فرق درجة قبلها (1.3 ضعفاً) فالخطوتان قبلها مطابقتان، والخلط جدول بعدها
+    img = _color_contrast_exact(img, saturation, contrast, brightness)
+    img = sharpen_vignette(img, sharpness)
+    return apply_tint(img, tint_alpha, tint_color)
+
+
+def apply_tint(img, tint_alpha, tint_color=(180, 20, 20)):
+    """الطبقة الملونة وحدها (نفس Image.blend مع لون ثابت) عبر جدول واحد"""
+    if not tint_alpha:
+        return img
+    return img.point(_tint_lut(tint_alpha, tint_color))
+
+
+# --- تحسين تلقائي: عوامل الألوان من إحصاءات نسخة 128px بدل ثوابت لكل الصور ---
+
+def image_stats(img, width=128):
+    """(متوسط الإضاءة، انحرافها، متوسط الكروما max-min) على نسخة بعرض ~128px"""
+    factor = max(1, img.width // width)
+    small = img.reduce(factor) if factor > 1 else img
+    x = np.asarray(small.convert('RGB'), np.float32)
+    luma = x @ np.asarray(_LUMA, np.float32)
+    r, g, b = x[..., 0], x[..., 1], x[..., 2]
+    chroma = np.maximum(np.maximum(r, g), b) - np.minimum(np.minimum(r, g), b)
+    return float(luma.mean()), float(luma.std()), float(chroma.mean())
+
+
+def auto_factors(stats, saturation=1.0, contrast=1.0):
+    """يعدل العوامل الثابتة حول قيم صورة إخبارية نموذجية: الداكنة تُفتح، الباهتة يرتفع تباينها،
+    والشاحبة يزيد تشبعها (والعكس بحدود). يعيد (saturation, contrast, brightness)"""
+    mean, std, chroma = stats
+    brightness = min(max((118 / max(mean, 1)) ** 0.5, 0.85), 1.35)
+    # الإضاءة تضرب الانحراف والكروما أيضاً: الخطوتان التاليتان تريان الصورة بعدها
+    contrast *= min(max((52 / max(std * brightness, 1)) ** 0.5, 0.8), 1.35)
+    saturation *= min(max((48 / max(chroma * brightness, 1)) ** 0.5, 0.7), 1.4)
+    return round(saturation, 2), round(contrast, 2), round(brightness, 2)
+
+
+def sweep_variants(img, combos, contrast=1.0, tint_color=(180, 20, 20), sharpness=None, thumb_size=(256, 144),
+                   auto=False):
+    """معاينات لعدة توليفات (الأحمر، التشبع) من نفس الصورة في مرور NumPy واحد:
+    التوليفات على محور جديد (N, H, W, 3) بدل تشغيل السلسلة N مرة"""
+    base = img.resize(thumb_size, Image.BOX) if thumb_size and img.size != thumb_size else img
+    sat_gain, brightness = 1.0, 1.0
+    if auto:
+        # الإحصاءات مرة واحدة؛ معامل التشبع نسبة ثابتة تُضرب في تشبع كل توليفة
+        sat_gain, contrast, brightness = auto_factors(image_stats(base), 1.0, contrast)
+    if sharpness:
+        # الحدة خطية ولا تعتمد على التوليفة: مرة واحدة قبل الألوان
+        base = sharpen_vignette(base, sharpness)
+    x = np.asarray(base.convert('RGB'), np.float32)
+    if brightness != 1:
+        x = np.clip(x * np.float32(brightness), 0, 255)
+    gray = (x @ np.asarray(_LUMA, np.float32))[..., np.newaxis]
+    # متوسط الإضاءة لا يتغير مع التشبع (Color يخلط مع نفس الرمادي)
+    mean = np.float32(gray.mean())
+    red = np.asarray([c[0] for c in combos], np.float32)[:, None, None, None]
+    sat = np.asarray([c[1] * sat_gain for c in combos], np.float32)[:, None, None, None]
+
+    # القطع بعد كل خطوة كما في ImageEnhance
+    out = sat * (x - gray)
+    out += gray
+    np.clip(out, 0, 255, out=out)
+    out -= mean
+    out *= np.float32(contrast)
+    out += mean
+    np.clip(out, 0, 255, out=out)
+    out *= 1 - red
+    out += red * np.asarray(tint_color, np.float32)
+    np.clip(out, 0, 255, out=out)
+    return [Image.fromarray(v) for v in out.astype(np.uint8)]
+
+
+# --- قناع الفينييت (ذاكرة مشتركة بين كل جلسات Streamlit في نفس العملية) ---
+
+# المقاسات الثابتة (768x432، المعاينة، النسخ) تبقى في الذاكرة. الأكبر منها مقاسات صور أصلية
+# في تطبيقات لا تصغر، قلما يتكرر مقاسها: تُبنى لكل صورة بدل أن تحجز 32 قناعاً بدقة كاملة
+VIGNETTE_CACHE_PIXELS = 1024 * 1024
+
+
+def get_vignette_mask(width, height, exponent=1.5, darkness=255):
+    """قناع L جاهز: 255 في الوسط ويتدرج نحو الأطراف، يُبنى مرة واحدة لكل مقاس صغير.
+    أقصى ما تحجزه الذاكرة 32 قناعاً × VIGNETTE_CACHE_PIXELS بايت"""
+    if width * height > VIGNETTE_CACHE_PIXELS:
+        return _vignette_mask(width, height, exponent, darkness)
+    return _cached_vignette_mask(width, height, exponent, darkness)
+
+
+@lru_cache(maxsize=32)
+def _cached_vignette_mask(width, height, exponent, darkness):
+    return _vignette_mask(width, height, exponent, darkness)
+
+
+def _vignette_mask(width, height, exponent, darkness):
+    x = np.linspace(-1, 1, width, dtype=np.float32)
+    y = np.linspace(-1, 1, height, dtype=np.float32)
+    # نفس شكل meshgrid الأصلي لكن عبر البث (broadcasting) وبدقة float32
+    radius = np.sqrt(x[np.newaxis, :] ** 2 + y[:, np.newaxis] ** 2)
+    radius /= radius.max()
+    alpha = np.power(1 - radius, exponent, dtype=np.float32)
+    mask = (alpha * 255).astype(np.uint8)
+    if darkness != 255:
+        # darkness < 255: الأطراف لا تصل إلى الأسود الكامل
+        mask = (255 - (255 - mask.astype(np.uint16)) * darkness // 255).astype(np.uint8)
+    return Image.fromarray(mask)
+
+
+# --- نواة مدمجة: الحدة + الفينييت في مرور واحد على شرائح أفقية ---
+
+# عدد الخيوط محفوظ هنا (لا نقرأ خصائص ThreadPoolExecutor الداخلية).
+# _POOL للأعمال الطرفية فقط (شرائح، أجزاء مكدس، ترميز): عمل داخل خيط منه لا يرسل إليه وينتظر،
+# بل يُنفذ مباشرة، وإلا امتلأت الخيوط بمهام تنتظر مهام لن تبدأ. خانات الكولاج لها مجمعها الخاص
+_WORKERS = os.cpu_count() or 2
+_MIN_BAND_ROWS = 64
+_worker = threading.local()
+
+
+def _mark_worker():
+    _worker.active = True
+
+
+def _pool_workers():
+    """عدد الخيوط المتاحة لتقسيم عمل جديد: 1 داخل خيط من _POOL نفسه"""
+    return 1 if getattr(_worker, 'active', False) else _WORKERS
+
+
+_POOL = ThreadPoolExecutor(max_workers=_WORKERS, initializer=_mark_worker)
+_TILE_POOL = ThreadPoolExecutor(max_workers=_WORKERS)
+
+
+def _sharpen_band(src, dst, y0, y1, amount, mask, edge_color):
+    h, w = src.shape[:2]
+    # الشريحة + صف إضافي من كل جهة (halo) للنواة 3x3، بدقة float32 (القيم الصحيحة دقيقة فيها)
+    a, b = max(y0 - 1, 0), min(y1 + 1, h)
+    block = src[a:b].astype(np.float32)
+    band = block[y0 - a:y1 - a]
+
+    # أطراف الصورة لا تُفلتر (نفس سلوك ImageFilter.SMOOTH)
+    r0, r1 = max(y0, 1), min(y1, h - 1)
+    if amount != 1.0 and r1 > r0 and w > 2:
+        rows = block[r0 - a - 1:r1 - a - 1] + block[r0 - a:r1 - a]
+        rows += block[r0 - a + 1:r1 - a + 1]
+        centre = band[r0 - y0:r1 - y0, 1:-1]
+        # SMOOTH في PIL: 1 في كل الخانات و5 في الوسط، المجموع 13 (مع التقريب)
+        smooth = rows[:, :-2] + rows[:, 1:-1]
+        smooth += rows[:, 2:]
+        smooth += 4 * centre
+        smooth += 6.5
+        smooth *= np.float32(1 / 13)
+        np.floor(smooth, out=smooth)
+        # blend(smooth, img, amount) ثم القطع كما في Image.blend
+        centre -= smooth
+        centre *= np.float32(amount)
+        centre += smooth
+        np.clip(centre, 0, 255, out=centre)
+        np.floor(centre, out=centre)
+
+    if mask is not None:
+        m = mask[y0:y1, :, np.newaxis].astype(np.float32)
+        band *= m
+        if any(edge_color):
+            band += np.asarray(edge_color, np.float32) * (255 - m)
+        band += 127.5
+        band *= np.float32(1 / 255)
+    dst[y0:y1] = band
+
+
+def sharpen_vignette(img, sharpness=1.0, mask=None, edge_color=(0, 0, 0)):
+    """ImageEnhance.Sharpness ثم Image.composite مع لون الأطراف، في مرور واحد متعدد الخيوط"""
+    workers = _pool_workers()
+    if workers == 1:
+        # نواة واحدة (أو داخل خيط من _POOL): دوال PIL المكتوبة بلغة C أسرع من NumPy دون توازي
+        img = ImageEnhance.Sharpness(img.convert('RGB')).enhance(sharpness)
+        if mask is not None:
+            img = Image.composite(img, Image.new('RGB', img.size, tuple(edge_color)), mask)
+        return img
+
+    src = np.asarray(img.convert('RGB'))
+    dst = np.empty_like(src)
+    mask_arr = np.asarray(mask) if mask is not None else None
+
+    h = src.shape[0]
+    n_bands = max(1, min(workers, h // _MIN_BAND_ROWS))
+    edges = np.linspace(0, h, n_bands + 1).astype(int)
+    jobs = [
+        _POOL.submit(_sharpen_band, src, dst, y0, y1, sharpness, mask_arr, edge_color)
+        for y0, y1 in zip(edges[:-1], edges[1:])
+    ]
+    for job in jobs:
+        job.result()
+    return Image.fromarray(dst)
+
+
+# --- نفس السلسلة على مكدس صور بنفس المقاس (N, H, W, 3) للدفعات ---
+
+BATCH_MEMORY = int(os.environ.get("EDITOR_BATCH_MEMORY_MB", "256")) * 1024 * 1024
+
+
+def stack_chunk_size(size=TARGET_SIZE, mem_limit=None):
+    """كم صورة في كل مكدس: لكل صورة المصدر uint8 + نسخة العمل float32 + الرمادي float32،
+    ومرة واحدة مؤقتا نواة الحدة (box وtotal) لأنها تُحسب صورة بصورة"""
+    w, h = size
+    per_image = w * h * (3 + 3 * 4 + 4)
+    fixed = w * h * 3 * 4 * 2
+    return max(1, ((mem_limit or BATCH_MEMORY) - fixed) // per_image)
+
+
+def _stack_luma(x):
+    # convert('L') في PIL: أوزان صحيحة بدقة 16 بت مع التقريب (الناتج دقيق في float32)
+    luma = x @ np.asarray((19595, 38470, 7471), np.float32)
+    luma += 32768
+    luma *= np.float32(1 / 65536)
+    return np.floor(luma, out=luma)
+
+
+def enhance_stack(stack, saturation, contrast, tint_alpha=0.0, tint_color=(180, 20, 20),
+                  sharpness=None, mask=None, edge_color=(0, 0, 0)):
+    """Color -> Contrast -> Sharpness -> الطبقة الملونة -> الفينييت على كل الصور معاً.
+    stack: مصفوفة uint8 بشكل (N, H, W, 3)، والنتيجة تُكتب فيها مطابقة لسلسلة PIL.
+    كل خطوة تُقص وتُقطع كما يفعل Image.blend، وإلا تراكمت الكسور في اتجاه واحد"""
+    x = stack.astype(np.float32)
+
+    # Color: رمادي + s*(x - رمادي) لكل صورة، والرمادي كما في convert('L')
+    gray = _stack_luma(x)[..., np.newaxis]
+    x -= gray
+    x *= np.float32(saturation)
+    x += gray
+    del gray
+    np.clip(x, 0, 255, out=x)
+    np.floor(x, out=x)
+
+    # Contrast: متوسط + c*(x - متوسط)، بمتوسط إضاءة كل صورة على حدة كما في ImageStat، بشكل (N, 1, 1, 1)
+    mean = np.floor(_stack_luma(x).mean(axis=(1, 2), dtype=np.float64) + 0.5)
+    mean = mean.astype(np.float32)[:, None, None, None]
+    x -= mean
+    x *= np.float32(contrast)
+    x += mean
+    np.clip(x, 0, 255, out=x)
+    np.floor(x, out=x)
+
+    if sharpness and sharpness != 1.0:
+        # blend(SMOOTH, x, a) كما في _sharpen_band: SMOOTH = (مجموع 3x3 + 4*الوسط)/13 مقرب، والأطراف دون فلترة
+        # صورة بصورة: المؤقتات بحجم صورة واحدة مهما كان طول المكدس
+        for img in x:
+            box = img[:-2] + img[1:-1]
+            box += img[2:]
+            smooth = box[:, :-2] + box[:, 1:-1]
+            smooth += box[:, 2:]
+            del box
+            centre = img[1:-1, 1:-1]
+            smooth += 4 * centre
+            smooth += 6.5
+            smooth *= np.float32(1 / 13)
+            np.floor(smooth, out=smooth)
+            centre -= smooth
+            centre *= np.float32(sharpness)
+            centre += smooth
+            del smooth
+            np.clip(centre, 0, 255, out=centre)
+            np.floor(centre, out=centre)
+
+    if tint_alpha:
+        # Image.blend مع لون ثابت: x + a*(اللون - x)، صورة بصورة
+        color = np.asarray(tint_color, np.float32)
+        for img in x:
+            shift = color - img
+            shift *= np.float32(tint_alpha)
+            img += shift
+        np.floor(x, out=x)
+
+    if mask is not None:
+        # Image.composite يقرب (القسمة على 255 مع نصف)، كما في _sharpen_band
+        m = np.asarray(mask, np.float32)[np.newaxis, :, :, np.newaxis]
+        x *= m
+        if any(edge_color):
+            x += np.asarray(edge_color, np.float32) * (255 - m)
+        x += 127.5
+        x *= np.float32(1 / 255)
+        np.floor(x, out=x)
+
+    stack[...] = x
+    return stack
+
+
+def split_stack(stack, fn, *args, **kwargs):
+    """يقسم المكدس على محور N بين خيوط _POOL (عمليات NumPy تحرر GIL) ويجمع نتائج fn بالترتيب"""
+    n = len(stack)
+    edges = np.linspace(0, n, max(1, min(_pool_workers(), n)) + 1).astype(int)
+    if len(edges) == 2:
+        return list(fn(stack, *args, **kwargs))
+    jobs = [_POOL.submit(fn, stack[a:b], *args, **kwargs) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+    results = []
+    for job in jobs:
+        results.extend(job.result())
+    return results
+
+
+def read_source(source, is_url, timeout=10):
+    """بايتات المصدر كاملة (رابط، ملف مرفوع، أو مسار) لحساب البصمة ثم فك الترميز"""
+    if is_url:
+        response = requests.get(source, timeout=timeout)
+        # صفحة خطأ (HTML) لا تُحسب بصمتها ولا تُحفظ نتيجتها كأنها صورة
+        response.raise_for_status()
+        return response.content
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+# --- المعاينة السريعة (≈400px، نفس عرض st.image في الواجهة) ---
+
+PREVIEW_SIZE = (400, 225)
+
+
+def make_preview_proxy(data, preview_size=PREVIEW_SIZE, max_crop=0.25):
+    """نسخة مصغرة مفكوكة من الإطار كاملاً، تكفي لمعاينة أي نسبة قص حتى max_crop"""
+    # أكبر نسبة قص تعطي أصغر مربع مصدر، أي أكبر مقياس مطلوب
+    img = open_for_target(io.BytesIO(data), preview_size, max_crop)
+    box = plan_cover_box(img.size, preview_size, max_crop)
+    scale = preview_size[0] / (box[2] - box[0])
+    if scale < 1:
+        size = (max(1, math.ceil(img.width * scale)), max(1, math.ceil(img.height * scale)))
+        img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return img
+
+
+# --- طبقة الترميز: الصيغة، الجودة، تقليل الألوان (chroma) وحذف البيانات الوصفية ---
+
+OUTPUT_FORMATS = {
+    # المفتاح: (صيغة PIL، نوع MIME، امتداد الملف)
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'avif': ('AVIF', 'image/avif', 'avif'),
+    'png': ('PNG', 'image/png', 'png'),
+}
+
+
+def available_formats():
+    """الصيغ المتاحة في نسخة Pillow المثبتة (AVIF اختياري)"""
+    fmts = ['jpeg']
+    if features.check('webp'):
+        fmts.append('webp')
+    if features.check('avif'):
+        fmts.append('avif')
+    return fmts
+
+
+def output_mime(fmt):
+    return OUTPUT_FORMATS[fmt.lower()][1]
+
+
+def output_ext(fmt):
+    return OUTPUT_FORMATS[fmt.lower()][2]
+
+
+def encode_image(img, fmt='jpeg', quality=95, subsampling='4:2:0', strip_metadata=True,
+                 max_bytes=None, min_similarity=None):
+    """ترميز الصورة النهائية: JPEG تدريجي ومحسّن، WebP، AVIF أو PNG.
+    صيغة غير متاحة في Pillow المثبتة ترفع ValueError بدل ترميز JPEG باسم ونوع صيغة أخرى"""
+    fmt = fmt.lower()
+    if fmt not in available_formats() and fmt != 'png':
+        raise ValueError(f"الصيغة {fmt} غير متاحة (المتاح: {', '.join(available_formats() + ['png'])})")
+    if (max_bytes or min_similarity) and fmt != 'png':
+        # PNG بدون فقدان ولا جودة فيه: لا بحث، ترميز واحد
+        return encode_to_budget(img, fmt, max_bytes, min_similarity, q_hi=quality,
+                                subsampling=subsampling, strip_metadata=strip_metadata)
+    params = {}
+    if fmt == 'jpeg':
+        params = dict(quality=quality, optimize=True, progressive=True, subsampling=subsampling)
+    elif fmt == 'webp':
+        # WebP بفقدان يستعمل 4:2:0 دائماً
+        params = dict(quality=quality, method=6)
+    elif fmt == 'avif':
+        params = dict(quality=quality, subsampling=subsampling)
+    elif fmt == 'png':
+        # PNG بدون فقدان: quality لا معنى لها هنا
+        params = dict(optimize=True)
+
+    if strip_metadata:
+        params.update(exif=b'', icc_profile=None)
+    else:
+        params.update(exif=img.info.get('exif', b''), icc_profile=img.info.get('icc_profile'))
+
+    buf = io.BytesIO()
+    img.save(buf, format=OUTPUT_FORMATS[fmt][0], **params)
+    return buf.getvalue()
+
+
+# --- نسخ متعددة من فك ترميز ومعالجة واحدين (الصورة البارزة، بطاقة اجتماعية، مصغرة) ---
+
+RENDITIONS = {'featured': (768, 432), 'social': (1200, 630), 'thumb': (300, 169)}
+
+
+def master_size(sizes, aspect=TARGET_SIZE):
+    """أصغر إطار بنسبة aspect يكفي لقص كل نسخة منه دون تكبير"""
+    ratio = aspect[0] / aspect[1]
+    width = max(max(w, h * ratio) for w, h in sizes)
+    return int(math.ceil(width)), int(math.ceil(width / ratio))
+
+
+def render_renditions(master, sizes):
+    """كل نسخة = قص مركزي + تصغير من نفس الصورة المعالجة"""
+    return {name: master if master.size == size else render_cover(master, size)
+            for name, size in sizes.items()}
+
+
+def encode_renditions(images, **enc):
+    """ترميز كل النسخ بالتوازي (مكتبة PIL تحرر GIL أثناء الترميز)"""
+    names = list(images)
+    mapper = _POOL.map if _pool_workers() > 1 else map
+    encoded = mapper(lambda name: encode_image(images[name], **enc), names)
+    return dict(zip(names, encoded))
+
+
+# --- الكولاج: من 1 إلى 6 صور في إطار واحد ---
+
+def _grid(cols, rows):
+    # الترتيب من اليمين إلى اليسار ثم من الأعلى (الصورة الأولى في أعلى اليمين)
+    return [
+        ((cols - 1 - c) / cols, r / rows, (cols - c) / cols, (r + 1) / rows)
+        for r in range(rows) for c in range(cols)
+    ]
+
+
+# كل تخطيط: خانات (x0, y0, x1, y1) بنسب من الإطار، بنفس ترتيب الصور
+COLLAGE_LAYOUTS = {
+    'single': _grid(1, 1),
+    'side_by_side': _grid(2, 1),
+    'two_plus_one': [(1 / 2, 0, 1, 1), (0, 0, 1 / 2, 1 / 2), (0, 1 / 2, 1 / 2, 1)],
+    'three_columns': _grid(3, 1),
+    'grid_2x2': _grid(2, 2),
+    'two_plus_three': _grid(2, 2)[:2] + [(x0, 1 / 2, x1, 1) for x0, _, x1, _ in _grid(3, 1)],
+    'grid_3x2': _grid(3, 2),
+}
+
+
+def layouts_for(count):
+    """أسماء التخطيطات التي تسع هذا العدد من الصور"""
+    return [name for name, cells in COLLAGE_LAYOUTS.items() if len(cells) == count]
+
+
+def layout_boxes(layout, size=TARGET_SIZE):
+    """خانات التخطيط بالبكسل؛ التقريب نفسه على الحدود المشتركة فلا فراغات بين الخانات"""
+    w, h = size
+    return [
+        (round(x0 * w), round(y0 * h), round(x1 * w), round(y1 * h))
+        for x0, y0, x1, y1 in COLLAGE_LAYOUTS[layout]
+    ]
+
+
+def compose_collage(sources, layout, size=TARGET_SIZE, tile_fn=None, smart=False):
+    """يعالج كل صورة في خانتها بالتوازي ويكتبها مباشرة في لوحة واحدة محجوزة مسبقاً.
+    tile_fn: تأثيرات كل خانة (بدون الفينييت، الذي يُطبق مرة واحدة على اللوحة النهائية)
+    smart: نافذة كل خانة حيث الموضوع بدل الوسط (مفيد للخانات الطولية)"""
+    boxes = layout_boxes(layout, size)
+    if len(sources) != len(boxes):
+        raise ValueError(f"التخطيط {layout} يحتاج {len(boxes)} صور")
+    canvas = np.zeros((size[1], size[0], 3), np.uint8)
+
+    def render_tile(source, box):
+        x0, y0, x1, y1 = box
+        tile_size = (x1 - x0, y1 - y0)
+        tile = render_cover(open_for_target(source, tile_size), tile_size, smart=smart)
+        if tile_fn:
+            tile = tile_fn(tile)
+        # الخانات لا تتقاطع، فكل خيط يكتب في جزئه من اللوحة دون قفل
+        canvas[y0:y1, x0:x1] = np.asarray(tile.convert('RGB'))
+
+    # مجمع منفصل: tile_fn قد يستدعي sharpen_vignette أو enhance_colors التي ترسل شرائحها إلى _POOL
+    jobs = [_TILE_POOL.submit(render_tile, source, box) for source, box in zip(sources, boxes)]
+    for job in jobs:
+        job.result()
+    return Image.fromarray(canvas)
+
+
+# --- البحث عن الجودة حسب ميزانية الحجم أو حد أدنى للتشابه ---
+
+def _luma(img):
+    return np.asarray(img.convert('L'), dtype=np.float32)
+
+
+def _ssim(ref, test, block=8):
+    """SSIM مبسط على كتل 8x8 من الإضاءة (تقدير سريع للتشابه البصري)"""
+    h, w = (ref.shape[0] // block) * block, (ref.shape[1] // block) * block
+    a = ref[:h, :w].reshape(h // block, block, w // block, block)
+    b = test[:h, :w].reshape(h // block, block, w // block, block)
+    mu_a, mu_b = a.mean(axis=(1, 3)), b.mean(axis=(1, 3))
+    var_a, var_b = a.var(axis=(1, 3)), b.var(axis=(1, 3))
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def encode_to_budget(img, fmt='jpeg', max_bytes=None, min_similarity=None, q_lo=40, q_hi=95, **enc):
+    """بحث ثنائي على الجودة فوق نفس البكسلات:
+    أعلى جودة لا تتجاوز max_bytes، و/أو أقل جودة تحافظ على min_similarity (SSIM).
+    إن تجاوزت حتى q_lo الميزانية يعود ترميز q_lo مع RuntimeWarning (قارن len بـ max_bytes)"""
+    attempts = {}
+    ref = _luma(img) if min_similarity else None
+
+    def encoded(q):
+        if q not in attempts:
+            attempts[q] = encode_image(img, fmt, q, **enc)
+        return attempts[q]
+
+    def similar(q):
+        return _ssim(ref, _luma(Image.open(io.BytesIO(encoded(q))))) >= min_similarity
+
+    quality = q_hi
+    if max_bytes:
+        # أعلى جودة ضمن الحجم (الحجم يزيد مع الجودة)
+        lo, hi, best = q_lo, q_hi, q_lo
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if len(encoded(mid)) <= max_bytes:
+                best, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+        quality = best
+        if len(encoded(best)) > max_bytes:
+            warnings.warn(
+                f"أقل جودة ({q_lo}) تعطي {len(encoded(best)) >> 10} KB فوق الميزانية {max_bytes >> 10} KB",
+                RuntimeWarning, stacklevel=3,
+            )
+    if min_similarity:
+        # أقل جودة تحافظ على التشابه، دون تجاوز ما تسمح به الميزانية
+        lo, hi, best = q_lo, quality, quality
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if similar(mid):
+                best, hi = mid, mid - 1
+            else:
+                lo = mid + 1
+        quality = best
+    return encoded(quality)
@@ -0,0 +1,22 @@
+# --- سلسلة المعالجة كمراحل محفوظة: كل مرحلة تُعاد فقط إذا تغيرت مدخلاتها ---
+
+
+class StageGraph:
+    """ذاكرة مراحل لكل جلسة: مفتاح كل مرحلة = مفتاح المرحلة السابقة + إعداداتها"""
+
+    def __init__(self):
+        self._memo = {}
+
+    def stage(self, name, fn, parent=None, **params):
+        """يشغل fn(ناتج parent) أو يعيد الناتج المحفوظ إذا لم يتغير شيء قبله"""
+        parent_key, parent_value = self._memo[parent] if parent else (None, None)
+        key = (parent_key, tuple(sorted(params.items())))
+        hit = self._memo.get(name)
+        if hit is not None and hit[0] == key:
+            return hit[1]
+        value = fn(parent_value) if parent else fn()
+        self._memo[name] = (key, value)
+        return value
+
+    def clear(self):
+        self._memo.clear()
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from image_engine import enhance_colors, enhance_stack, get_vignette_mask
+
+# --- المسار المدمج في enhance_colors مقابل سلسلة ImageEnhance الحقيقية (±1 درجة) ---
+
+# (التشبع، التباين، الأحمر، لونه، الحدة) كما في كل تطبيق
+CHAINS = {
+    'code9': (1.6, 1.15, 0.08, (180, 20, 20), 1.3),
+    'appok': (1.5, 1.1, 0.1, (150, 0, 0), None),
+    'DriouchcityIMAGE': (0.8, 1.3, 0.0, (0, 0, 0), 1.2),
+}
+
+
+def _photo(seed, size=(768, 432)):
+    # ألوان ناعمة + ضجيج + خطوط حادة: مناطق مشبعة وحواف تضخمها الحدة
+    w, h = size
+    rng = np.random.default_rng(seed)
+    base = Image.fromarray(rng.integers(0, 256, (8, 12, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    a = np.asarray(base).astype(np.int16) + rng.normal(0, 12, (h, w, 3)).astype(np.int16)
+    a[::7] = 255
+    a[:, ::11] = 0
+    return Image.fromarray(np.clip(a, 0, 255).astype(np.uint8))
+
+
+def _reference(img, saturation, contrast, tint_alpha, tint_color, sharpness):
+    img = ImageEnhance.Color(img).enhance(saturation)
+    img = ImageEnhance.Contrast(img).enhance(contrast)
+    if sharpness:
+        img = ImageEnhance.Sharpness(img).enhance(sharpness)
+    if tint_alpha:
+        img = Image.blend(img, Image.new('RGB', img.size, tint_color), tint_alpha)
+    return img
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('app', sorted(CHAINS))
+def test_enhance_colors_matches_chain(app, seed):
+    saturation, contrast, tint_alpha, tint_color, sharpness = CHAINS[app]
+    img = _photo(seed)
+    expected = np.asarray(_reference(img, saturation, contrast, tint_alpha, tint_color, sharpness), np.int16)
+    fused = enhance_colors(img, saturation, contrast, tint_alpha, tint_color, sharpness=sharpness)
+    assert fused.size == img.size
+    assert np.abs(np.asarray(fused, np.int16) - expected).max() <= 1
+
+
+@pytest.mark.parametrize('vignette', [False, True])
+@pytest.mark.parametrize('app', sorted(CHAINS))
+def test_enhance_stack_matches_chain(app, vignette):
+    saturation, contrast, tint_alpha, tint_color, sharpness = CHAINS[app]
+    images = [_photo(seed) for seed in range(3)]
+    mask = get_vignette_mask(*images[0].size) if vignette else None
+    stack = np.stack([np.asarray(img) for img in images])
+    enhance_stack(stack, saturation, contrast, tint_alpha, tint_color, sharpness, mask, (10, 0, 0))
+    for img, out in zip(images, stack):
+        expected = _reference(img, saturation, contrast, tint_alpha, tint_color, sharpness)
+        if vignette:
+            expected = Image.composite(expected, Image.new('RGB', img.size, (10, 0, 0)), mask)
+        assert np.abs(out.astype(np.int16) - np.asarray(expected, np.int16)).max() <= 1
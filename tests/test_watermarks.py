@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont, features
+
+import image_engine
+from image_engine import AUTO_CROP, find_watermarks, plan_cover, watermark_templates
+
+# --- كشف علامات الزوايا وخطة القص حولها ---
+
+
+def _background(seed, size=(1600, 900)):
+    # ألوان ناعمة + ضجيج، بلا خطوط منتظمة
+    w, h = size
+    rng = np.random.default_rng(seed)
+    base = Image.fromarray(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    a = np.asarray(base).astype(np.int16) + rng.normal(0, 12, (h, w, 3)).astype(np.int16)
+    return Image.fromarray(np.clip(a, 0, 255).astype(np.uint8))
+
+
+def _logo(text):
+    font = ImageFont.load_default(96)
+    left, top, right, bottom = font.getbbox(text)
+    logo = Image.new('RGBA', (right - left + 12, bottom - top + 12), (255, 255, 255, 0))
+    ImageDraw.Draw(logo).text((6 - left, 6 - top), text, font=font, fill=(255, 255, 255, 255),
+                              stroke_width=2, stroke_fill=(0, 0, 0, 160))
+    return logo
+
+
+@pytest.fixture
+def library(tmp_path):
+    if not features.check('freetype2'):
+        pytest.skip("الخط الافتراضي القابل للتحجيم يحتاج FreeType")
+    for name in ('REUTERS', 'EFE'):
+        _logo(name).save(tmp_path / f'{name}.png')
+    return watermark_templates(str(tmp_path))
+
+
+def _overlay(img, logo, width, opacity):
+    # علامة شبه شفافة في الزاوية السفلية اليمنى بهامش 2%
+    w = round(img.width * width)
+    logo = logo.resize((w, round(w * logo.height / logo.width)), Image.LANCZOS)
+    logo.putalpha(logo.getchannel('A').point(lambda a: int(a * opacity)))
+    margin = round(img.width * 0.02)
+    out = img.convert('RGBA')
+    out.alpha_composite(logo, (img.width - logo.width - margin, img.height - logo.height - margin))
+    return out.convert('RGB')
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_semi_transparent_mark_found_in_its_corner(library, seed):
+    img = _overlay(_background(seed), _logo('REUTERS'), 0.2, 0.5)
+    found = find_watermarks(img, library)
+    assert [name for name, _, _ in found] == ['REUTERS']
+    x0, y0, x1, y1 = found[0][2]
+    assert x0 > 0.5 and y0 > 0.5
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_clean_image_has_no_marks(library, seed):
+    assert find_watermarks(_background(seed), library) == []
+
+
+def test_tall_exclusions_fall_back_to_band_crop(monkeypatch):
+    # منطقتان تغطيان الارتفاع كله: لا نافذة تتجنبهما ولا قص يتسع لهما
+    monkeypatch.setattr(image_engine, 'detect_logo_band', lambda img: (0.0, 0.0))
+    monkeypatch.setattr(image_engine, 'find_watermarks', lambda img: [
+        ('a', 20.0, (0.0, 0.0, 1.0, 0.55)), ('b', 20.0, (0.0, 0.45, 1.0, 1.0)),
+    ])
+    img = _background(0, (768, 432))
+    for smart in (False, True):
+        x0, y0, x1, y1 = plan_cover(img, (768, 432), AUTO_CROP, smart)
+        assert y1 - y0 > 0 and x1 - x0 > 0